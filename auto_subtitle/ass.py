@@ -0,0 +1,216 @@
+import os
+import json
+from PIL import ImageFont
+from .emoji_atlas import get_emoji_atlas
+from .emoji import (
+    SUBTITLE_FONT, CAPTION_FONT_FILE, CAPTION_SAFE_Y_RATIO, CAPTION_SAFE_WIDTH_RATIO,
+    CAPTION_SAFE_HEIGHT_RATIO, choose_emoji, get_emoji_size, path_to_emoji,
+    select_broll_segments, get_broll_image,
+)
+
+# Caption engine that lets ffmpeg burn in the captions: words become events in an
+# ASS script rendered by libass, emoji and B-roll become overlay inputs that are
+# only enabled while they are on screen. Nothing is composited per word in Python.
+
+CAPTION_STROKE_WIDTH = 4
+
+# ffmpeg expressions for the emoji effects in emoji.get_emoji_overlay, in terms of
+# the overlay's local time. Effects that animate the scale are drawn at full size.
+EMOJI_POSITION_EXPRESSIONS = {
+    "bounce": ("(W-w)/2", "{y}+20*{s}*sin(6*PI*{lt})"),
+    "zoom_in": ("{x}", "{y}"),
+    "spring": ("(W-w)/2", "{y}+40*{s}*exp(-1.5*{lt})*sin(6*PI*{lt})"),
+    "pop": ("{x}", "{y}"),
+    "slide_in": ("trunc(W*0.1)+trunc(W*0.5*{lt})", "{y}"),
+}
+
+def format_ass_timestamp(seconds: float):
+    centiseconds = max(int(round(seconds * 100)), 0)
+    hours, centiseconds = divmod(centiseconds, 360_000)
+    minutes, centiseconds = divmod(centiseconds, 6_000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+def escape_ass_text(text: str):
+    return text.replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}").replace("\n", " ")
+
+def caption_font_size(word, max_width, max_height, stroke_width=CAPTION_STROKE_WIDTH):
+    # Same fit-to-box behaviour as TextClip(method='caption') for a single word
+    size = max_height
+    if not os.path.exists(CAPTION_FONT_FILE):
+        return size
+    font = ImageFont.truetype(CAPTION_FONT_FILE, size)
+    width = font.getlength(word) + 2 * stroke_width
+    if width > max_width:
+        size = int(size * max_width / width)
+    return max(size, 1)
+
+def write_ass_captions(whisperx_json_path, output_file, size):
+    width, height = size
+    with open(whisperx_json_path, 'r') as f:
+        segments = json.load(f).get("segments", [])
+
+    caption_height = int(height * CAPTION_SAFE_HEIGHT_RATIO)
+    caption_width = int(width * CAPTION_SAFE_WIDTH_RATIO)
+    # Scaled like the moviepy engine's stroke for preview sizes
+    stroke_width = max(round(CAPTION_STROKE_WIDTH * max(size) / 1920), 1)
+    y_center = int(height * CAPTION_SAFE_Y_RATIO) + caption_height // 2
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+        "Alignment, MarginL, MarginR, MarginV, Encoding",
+        f"Style: Caption,{SUBTITLE_FONT},{caption_height},&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,"
+        f"0,0,0,0,100,100,0,0,1,{stroke_width / 2:g},0,5,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for segment in segments:
+        for word_info in segment.get("words", []):
+            word = word_info["word"]
+            font_size = caption_font_size(word, caption_width, caption_height, stroke_width)
+            text = f"{{\\an5\\pos({width // 2},{y_center})\\fs{font_size}}}{escape_ass_text(word)}"
+            lines.append(
+                f"Dialogue: 0,{format_ass_timestamp(word_info['start'])},{format_ass_timestamp(word_info['end'])},"
+                f"Caption,,0,0,0,,{text}"
+            )
+
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_file, output_file)
+    return output_file
+
+def escape_filter_path(path: str):
+    return path.replace("\\", "/").replace(":", "\\:").replace("'", "\\'")
+
+
+class FfmpegOverlays:
+    """Captions, emoji and B-roll for one clip, expressed as an ffmpeg filter graph."""
+
+    def __init__(self, ass_path, size, fps):
+        self.ass_path = ass_path
+        self.size = size
+        self.fps = fps
+        self.brolls = []  # (image_path, start, duration)
+        self.emojis = []  # (image_path, start, end, effect, x, y)
+
+    def filter_for_range(self, t_start, t_end, first_input_index=1):
+        """Returns (extra input args, filter_complex) for frames in [t_start, t_end), ending in [vout]."""
+        width, height = self.size
+        inputs = []
+        filters = []
+
+        # Chunks start at pts 0, shift them so `t` is the time in the clip
+        filters.append(f"[0:v]setpts=PTS+{t_start}/TB[base0]")
+        current = "base0"
+        step = 0
+
+        def next_label():
+            nonlocal step
+            step += 1
+            return f"base{step}"
+
+        # B-roll sits under the captions, like in build_overlays
+        for image_path, start, duration in self.brolls:
+            if start >= t_end or start + duration <= t_start:
+                continue
+            index = first_input_index + len(inputs)
+            inputs.append(["-i", image_path])
+            n_frames = max(int(round(duration * self.fps)), 1)
+            label = next_label()
+            filters.append(
+                f"[{index}:v]scale=w='iw*max({width}/iw,{height}/ih)*1.25':h=-2,crop={width}:{height},"
+                f"zoompan=z='1+0.2*on/{n_frames}':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+                f":d={n_frames}:s={width}x{height}:fps={self.fps},"
+                f"setpts=PTS-STARTPTS+{start}/TB[broll{step}]"
+            )
+            filters.append(
+                f"[{current}][broll{step}]overlay=eof_action=pass:enable='between(t,{start},{start + duration})'[{label}]"
+            )
+            current = label
+
+        label = next_label()
+        filters.append(f"[{current}]ass='{escape_filter_path(self.ass_path)}':fontsdir='.'[{label}]")
+        current = label
+
+        # One looped input per distinct emoji image, split between its occurrences
+        active = [e for e in self.emojis if e[1] < t_end and e[2] > t_start]
+        by_path = {}
+        for emoji in active:
+            by_path.setdefault(emoji[0], []).append(emoji)
+        sources = {}
+        for image_path, occurrences in by_path.items():
+            index = first_input_index + len(inputs)
+            inputs.append(["-loop", "1", "-i", image_path])
+            names = [f"e{index}_{i}" for i in range(len(occurrences))]
+            if len(names) == 1:
+                filters.append(f"[{index}:v]null[{names[0]}]")
+            else:
+                filters.append(f"[{index}:v]split={len(names)}" + "".join(f"[{n}]" for n in names))
+            for occurrence, name in zip(occurrences, names):
+                sources[id(occurrence)] = name
+
+        for emoji in active:
+            image_path, start, end, effect, x, y = emoji
+            x_expr, y_expr = EMOJI_POSITION_EXPRESSIONS[effect]
+            local_t = f"(t-{start})"
+            scale = max(width, height) / 1920
+            x_expr = x_expr.format(x=x, y=y, lt=local_t, s=f"{scale:g}")
+            y_expr = y_expr.format(x=x, y=y, lt=local_t, s=f"{scale:g}")
+            label = next_label()
+            filters.append(
+                f"[{current}][{sources[id(emoji)]}]overlay=x='{x_expr}':y='{y_expr}':eval=frame:shortest=1"
+                f":enable='between(t,{start},{end})'[{label}]"
+            )
+            current = label
+
+        filters.append(f"[{current}]setpts=PTS-STARTPTS[vout]")
+        return inputs, ";".join(filters)
+
+
+def build_ffmpeg_overlays(video_clip, whisperx_json_path, ass_path, fps):
+    with open(whisperx_json_path, 'r') as f:
+        segments = json.load(f).get("segments", [])
+
+    overlays = FfmpegOverlays(write_ass_captions(whisperx_json_path, ass_path, video_clip.size), video_clip.size, fps)
+    if not segments:
+        print("⚠️ No segments found for subtitles.")
+        return overlays
+
+    vertical = video_clip.h > video_clip.w
+    for segment in select_broll_segments(segments, video_clip.duration):
+        image_path = get_broll_image(segment, vertical, generate=False)
+        if image_path:
+            start = segment.get("start", 0)
+            duration = min(max(segment.get("end", 0) - start, 3), 5)
+            overlays.brolls.append((image_path, start, duration))
+
+    caption_height = int(video_clip.h * CAPTION_SAFE_HEIGHT_RATIO)
+    y_position = int(video_clip.h * CAPTION_SAFE_Y_RATIO)
+    emoji_y_position = y_position - caption_height
+    center_x = (video_clip.w // 2) - (get_emoji_size(video_clip) // 2)
+    for segment in segments:
+        for word_info in segment.get("words", []):
+            word = word_info["word"].lower()
+            start = word_info["start"]
+            choice = choose_emoji(word, start)
+            if not choice:
+                continue
+            emoji, effect = choice
+            emoji_end = max(word_info["end"], start + 1)
+            overlays.emojis.append(
+                (path_to_emoji(emoji, video_clip), start, emoji_end, effect, center_x, emoji_y_position)
+            )
+
+    get_emoji_atlas().save()
+    return overlays
@@ -0,0 +1,170 @@
+import subprocess
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+class AudioRingBuffer:
+    """Fixed-capacity float32 sample buffer, so streamed audio never grows past `capacity`."""
+
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+
+    def free(self):
+        return self.capacity - self.size
+
+    def write(self, samples):
+        if len(samples) > self.free():
+            raise ValueError(f"ring buffer overflow: {len(samples)} samples, {self.free()} free")
+        end = (self.start + self.size) % self.capacity
+        first = min(len(samples), self.capacity - end)
+        self.buffer[end:end + first] = samples[:first]
+        self.buffer[:len(samples) - first] = samples[first:]
+        self.size += len(samples)
+
+    def peek(self, n):
+        """Copy of the oldest `n` samples."""
+        n = min(n, self.size)
+        first = min(n, self.capacity - self.start)
+        if first == n:
+            return self.buffer[self.start:self.start + n].copy()
+        return np.concatenate([self.buffer[self.start:], self.buffer[:n - first]])
+
+    def consume(self, n):
+        n = min(n, self.size)
+        self.start = (self.start + n) % self.capacity
+        self.size -= n
+
+
+def stream_audio(path, sample_rate=SAMPLE_RATE, block_seconds=1.0):
+    """Yields mono float32 PCM blocks decoded by ffmpeg, without writing a .wav."""
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-i", path,
+        "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sample_rate), "-",
+    ]
+    block_bytes = int(block_seconds * sample_rate) * 4
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        pending = b""
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            data = pending + data
+            usable = len(data) - len(data) % 4
+            pending = data[usable:]
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=np.float32)
+    finally:
+        proc.stdout.close()
+        error = proc.stderr.read().decode(errors="replace")
+        proc.stderr.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        raise IOError(f"ffmpeg failed to decode audio from {path}:\n{error}")
+
+def quietest_cut(samples, search_samples, frame_samples):
+    """Index near the end of `samples` with the least energy, to avoid cutting words."""
+    search = samples[-search_samples:]
+    n_frames = len(search) // frame_samples
+    if n_frames < 2:
+        return len(samples)
+    frames = search[:n_frames * frame_samples].reshape(n_frames, frame_samples)
+    quietest = int(np.argmin(np.sqrt(np.mean(frames ** 2, axis=1))))
+    return len(samples) - len(search) + quietest * frame_samples + frame_samples // 2
+
+def iter_audio_windows(path, window_seconds=600.0, cut_search_seconds=5.0, sample_rate=SAMPLE_RATE):
+    """Yields (offset_seconds, samples) windows of at most `window_seconds`.
+
+    Windows are cut at the quietest point of their last `cut_search_seconds`, and
+    at most one window plus a block of audio is held in memory at a time.
+    """
+    window = int(window_seconds * sample_rate)
+    block_seconds = 1.0
+    ring = AudioRingBuffer(window + int(block_seconds * sample_rate))
+    search = int(cut_search_seconds * sample_rate)
+    frame = int(0.1 * sample_rate)
+    offset = 0
+
+    for block in stream_audio(path, sample_rate, block_seconds):
+        ring.write(block)
+        if ring.size >= window:
+            samples = ring.peek(window)
+            cut = quietest_cut(samples, search, frame)
+            yield offset / sample_rate, samples[:cut]
+            ring.consume(cut)
+            offset += cut
+
+    if ring.size:
+        yield offset / sample_rate, ring.peek(ring.size)
+
+def speech_regions(samples, sample_rate=SAMPLE_RATE, frame_seconds=0.03, margin_db=12.0,
+                   floor_db=-55.0, min_silence_seconds=1.0, pad_seconds=0.2):
+    """Energy-based voice activity: (start, end) sample ranges that are louder than the noise floor.
+
+    Gaps shorter than `min_silence_seconds` are bridged so pauses within a
+    sentence don't split it.
+    """
+    frame = int(frame_seconds * sample_rate)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return []
+    frames = samples[:n_frames * frame].reshape(n_frames, frame)
+    db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    threshold = max(np.percentile(db, 10) + margin_db, floor_db)
+    voiced = db > threshold
+
+    # Rising/falling edges of the voiced mask, in frames
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    pad = int(pad_seconds / frame_seconds)
+    min_gap = int(min_silence_seconds / frame_seconds)
+    regions = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        start, end = max(start - pad, 0), min(end + pad, n_frames)
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    return [(start * frame, min(end * frame, len(samples))) for start, end in regions]
+
+# Below this share of voiced audio the energy VAD most likely failed (speech over
+# music or constant noise leaves no silence to measure the floor against)
+MIN_VOICED_FRACTION = 0.25
+
+def speech_chunks(samples, sample_rate=SAMPLE_RATE, max_chunk_seconds=60.0, max_gap_seconds=3.0,
+                  cut_search_seconds=5.0, **vad_options):
+    """Groups speech regions into chunks of at most `max_chunk_seconds`.
+
+    Silence longer than `max_gap_seconds` always ends a chunk, so it's never
+    transcribed. Longer stretches of speech are split at their quietest point.
+    When hardly anything counts as speech, the whole recording is chunked
+    instead so nothing gets dropped.
+    """
+    max_chunk = int(max_chunk_seconds * sample_rate)
+    max_gap = int(max_gap_seconds * sample_rate)
+    regions = speech_regions(samples, sample_rate, **vad_options)
+    voiced = sum(end - start for start, end in regions)
+    if len(samples) and voiced < MIN_VOICED_FRACTION * len(samples):
+        print(f"⚠️ Only {voiced / len(samples):.0%} of the audio sounds like speech, transcribing all of it")
+        regions = [(0, len(samples))]
+
+    chunks = []
+    for start, end in regions:
+        if chunks and start - chunks[-1][1] <= max_gap and end - chunks[-1][0] <= max_chunk:
+            chunks[-1][1] = end
+        else:
+            chunks.append([start, end])
+
+    frame = int(vad_options.get("frame_seconds", 0.03) * sample_rate)
+    search = int(cut_search_seconds * sample_rate)
+    split = []
+    for start, end in chunks:
+        while end - start > max_chunk:
+            cut = start + quietest_cut(samples[start:start + max_chunk], search, frame)
+            split.append((start, cut))
+            start = cut
+        split.append((start, end))
+    return split
@@ -0,0 +1,45 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .emoji import select_broll_segments, get_broll_image
+from .stages import stage, report_stages, get_stage_callback
+
+
+class BrollPrefetcher:
+    """Generates B-roll images in the background while the rest of the pipeline runs.
+
+    Images are requested as soon as a transcript has its B-roll scores, for
+    every aspect ratio at once, and land in the artifact cache where
+    build_overlays picks them up. The renderer only has to wait() first.
+    """
+
+    def __init__(self, max_workers=4):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="broll")
+        self.futures = {}
+        self.lock = threading.Lock()  # inputs are prepared concurrently
+
+    def submit(self, whisperx_json_path, video_duration, verticals):
+        with open(whisperx_json_path, 'r') as f:
+            segments = json.load(f).get("segments", [])
+
+        for segment in select_broll_segments(segments, video_duration):
+            for vertical in verticals:
+                key = (segment["b_roll_prompt"], vertical)
+                with self.lock:
+                    if key not in self.futures:
+                        self.futures[key] = self.pool.submit(self._generate, get_stage_callback(), segment, vertical)
+
+    @staticmethod
+    def _generate(callback, segment, vertical):
+        # Timings are reported to whoever submitted the segment
+        with report_stages(callback), stage("broll_image"):
+            return get_broll_image(segment, vertical)
+
+    def wait(self):
+        with self.lock:
+            futures = list(self.futures.values())
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
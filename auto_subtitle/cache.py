@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Optional
+from .stages import note_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to atomic renames only
+    fcntl = None
+
+DEFAULT_BUDGET_BYTES = 20 * 1024 ** 3
+
+
+class ArtifactCache:
+    """Content-addressed store for pipeline artifacts.
+
+    Artifacts live at <root>/<stage>/<key[:2]>/<key><suffix>, where the key hashes
+    the content of the stage inputs together with the stage parameters. A
+    manifest tracks sizes and last access so the store can be kept under a disk
+    budget (least recently used first). Files are written under a temporary name
+    and renamed into place, and the manifest is updated under a file lock, so
+    several jobs can share the same cache directory.
+    """
+
+    def __init__(self, root, budget_bytes: Optional[int] = DEFAULT_BUDGET_BYTES):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self.lock_path = os.path.join(root, ".lock")
+        self._digests = {}
+        self._touched = set()
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+        manifest.setdefault("entries", {})
+        manifest.setdefault("digests", {})
+        return manifest
+
+    def _write_manifest(self, manifest):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def digest(self, path):
+        """sha256 of a file's content, remembered per (path, size, mtime)."""
+        stat = os.stat(path)
+        memo_key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        if memo_key in self._digests:
+            return self._digests[memo_key]
+
+        with self._locked():
+            digest = self._read_manifest()["digests"].get(memo_key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+            with self._locked():
+                manifest = self._read_manifest()
+                manifest["digests"][memo_key] = digest
+                self._write_manifest(manifest)
+
+        self._digests[memo_key] = digest
+        return digest
+
+    def key(self, stage, inputs=(), **params):
+        h = hashlib.sha256(stage.encode("utf-8"))
+        for path in inputs:
+            h.update(self.digest(path).encode("ascii"))
+        h.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return h.hexdigest()
+
+    def path(self, stage, key, suffix=""):
+        return os.path.join(self.root, stage, key[:2], key + suffix)
+
+    def lookup(self, stage, key, suffix="") -> Optional[str]:
+        """Returns the artifact path on a hit (and marks it as used), None on a miss."""
+        path = self.path(stage, key, suffix)
+        if not os.path.exists(path):
+            note_cache(False)
+            return None
+        note_cache(True)
+
+        relpath = os.path.relpath(path, self.root)
+        if relpath not in self._touched:
+            with self._locked():
+                manifest = self._read_manifest()
+                entry = manifest["entries"].setdefault(
+                    relpath, {"stage": stage, "size": os.path.getsize(path)})
+                entry["last_access"] = time.time()
+                self._write_manifest(manifest)
+            self._touched.add(relpath)
+        return path
+
+    @contextmanager
+    def produce(self, stage, key, suffix=""):
+        """Yields a temporary path to write the artifact to.
+
+        If the block leaves a file there it's atomically moved into the cache;
+        if it doesn't (or raises) nothing is recorded.
+        """
+        path = self.path(stage, key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path),
+                                f".{key}.{os.getpid()}.{threading.get_ident()}.tmp{suffix}")
+        try:
+            yield tmp_path
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, path)
+                self._record(stage, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _record(self, stage, path):
+        relpath = os.path.relpath(path, self.root)
+        with self._locked():
+            manifest = self._read_manifest()
+            manifest["entries"][relpath] = {
+                "stage": stage,
+                "size": os.path.getsize(path),
+                "last_access": time.time(),
+            }
+            self._evict(manifest, keep=relpath)
+            self._write_manifest(manifest)
+        self._touched.add(relpath)
+
+    def _evict(self, manifest, keep=None):
+        if self.budget_bytes is None:
+            return
+        entries = manifest["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for relpath, entry in sorted(entries.items(), key=lambda item: item[1].get("last_access", 0)):
+            if total <= self.budget_bytes:
+                break
+            if relpath == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.root, relpath))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            del entries[relpath]
+            self._touched.discard(relpath)
+
+
+_caches = {}
+_budget_bytes = DEFAULT_BUDGET_BYTES
+
+def configure_cache(budget_bytes: Optional[int]):
+    global _budget_bytes
+    _budget_bytes = budget_bytes
+    for cache in _caches.values():
+        cache.budget_bytes = budget_bytes
+
+def cache_budget() -> Optional[int]:
+    return _budget_bytes
+
+def get_cache(work_dir="work") -> ArtifactCache:
+    root = os.path.join(work_dir, "cache")
+    if root not in _caches:
+        _caches[root] = ArtifactCache(root, _budget_bytes)
+    return _caches[root]
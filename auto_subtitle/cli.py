@@ -1,21 +1,59 @@
 import os
+import sys
 import argparse
+import tempfile
+from dataclasses import dataclass
 from .utils import *
-from moviepy import VideoFileClip, CompositeVideoClip, concatenate_videoclips
-from .emoji import build_overlays
 from dotenv import load_dotenv
-from .face_tracking import track_face_centers
+from .cache import configure_cache
+from .models import configure_model_registry
+from .stages import (stage, report_stages, get_stage_callback, configure_profiling,
+                     configure_stage_limits, parse_stage_limits, STAGES)
+from .run_report import RunReport
 
 OUTPUT_DIR = ""
 WORK_DIR = "work"
 
-def main():
+# --preview renders a third of the resolution at 12 fps with a fast preset
+PREVIEW_SCALE = 1 / 3
+PREVIEW_FPS = 12
+
+# Upper bound on threads preparing inputs, the stage limits decide what actually runs
+PIPELINE_THREADS = 16
+DEFAULT_STAGE_LIMITS = "audio=2,transcribe=1,face_track=2,render=1"
+
+def parse_time_range(spec: str):
+    """Parses "120-180" (seconds) or "120-" (to the end) into (start, end)."""
+    start, sep, end = spec.partition("-")
+    try:
+        start = float(start) if start else 0.0
+        end = float(end) if end else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected START-END in seconds, got '{spec}'")
+    if not sep or start < 0 or (end is not None and end <= start):
+        raise argparse.ArgumentTypeError(f"expected START-END in seconds with START < END, got '{spec}'")
+    return start, end
+
+def build_parser():
     parser = argparse.ArgumentParser(
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog="Run 'auto_subtitle serve --help' for the long-running worker mode.")
     parser.add_argument("video", type=str, nargs='+',
                         help="paths to video files to transcribe (provide a list of video paths)")
-    parser.add_argument("--model", default="small",
+    parser.add_argument("--model", default="small.en",
                         help="name of the Whisper model to use")
+    parser.add_argument("--compute-type", type=str, default="float32", choices=["int8", "float16", "float32"],
+                        help="precision of the Whisper model, int8 trades some accuracy for CPU throughput")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="number of audio chunks transcribed per Whisper batch")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="CPU threads used by the Whisper model")
+    parser.add_argument("--transcribe-workers", type=int, default=1,
+                        help="CPU processes transcribing voice-activity chunks in parallel, each with its own model (1 transcribes serially)")
+    parser.add_argument("--stream-audio", type=float, default=0, metavar="WINDOW_SECONDS",
+                        help="pipe audio from ffmpeg straight into transcription in windows of this many seconds instead of extracting a .wav (0 disables)")
+    parser.add_argument("--model-memory", type=float, default=0,
+                        help="memory budget in GB for resident Whisper/alignment models, least recently used are unloaded (0 keeps all)")
     parser.add_argument("--output_dir", "-o", type=str,
                         default="subtitled", help="directory to save the outputs")
     parser.add_argument("--verbose", type=str2bool, default=False,
@@ -26,89 +64,355 @@ def main():
                         help="whether to skip output in 16x9 aspect ratio")
     parser.add_argument("--task", type=str, default="transcribe", choices=[
                         "transcribe", "translate"], help="whether to perform X->X speech recognition ('transcribe') or X->English translation ('translate')")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of processes rendering chunks of the timeline in parallel")
+    parser.add_argument("--caption-engine", type=str, default="moviepy", choices=["moviepy", "ass"],
+                        help="composite captions with moviepy, or burn them in with ffmpeg from an ASS script (faster)")
+    parser.add_argument("--score-workers", type=int, default=8,
+                        help="number of concurrent B-roll scoring requests")
+    parser.add_argument("--score-batch-size", type=int, default=1,
+                        help="number of transcript segments scored per B-roll scoring request")
+    parser.add_argument("--cache-budget", type=float, default=20,
+                        help="disk budget in GB for cached artifacts in the work directory, least recently used are evicted (0 disables eviction)")
+    parser.add_argument("--preview", action="store_true",
+                        help=f"quick proxy render at {PREVIEW_SCALE:.2g}x resolution and {PREVIEW_FPS} fps, written next to the full outputs with a _preview suffix")
+    parser.add_argument("--range", type=parse_time_range, default=None, metavar="START-END",
+                        help="only render this window of the output in seconds, e.g. 120-180")
+    parser.add_argument("--stage-limits", type=str, default=DEFAULT_STAGE_LIMITS,
+                        help=f"maximum inputs in each stage at once ({', '.join(STAGES)}), stages of different inputs run concurrently")
+    parser.add_argument("--report", type=str, default=None, metavar="PATH",
+                        help="write a JSON report with wall/CPU time, memory use, fps and cache hits of every stage")
+    parser.add_argument("--profile", type=str, default=None, choices=["cprofile", "pyinstrument"],
+                        help="profile every stage, profiles are written to <work>/profiles")
+    return parser
+
+def job_from_args(args):
+    """Turns parsed CLI arguments into (video_paths, horizontals, options, output_dir)."""
+    horizontals = []
+    if not args.skip_vertical:
+        horizontals.append(False)
+    if not args.skip_horizontal:
+        horizontals.append(True)
+
+    options = PipelineOptions(
+        model=args.model,
+        compute_type=args.compute_type,
+        batch_size=args.batch_size,
+        threads=args.threads,
+        stream_audio=args.stream_audio,
+        transcribe_workers=args.transcribe_workers,
+        jobs=args.jobs,
+        caption_engine=args.caption_engine,
+        score_workers=args.score_workers,
+        score_batch_size=args.score_batch_size,
+        preview=args.preview,
+        time_range=args.range,
+    )
+    return args.video, horizontals, options, args.output_dir
+
+def main():
+    global OUTPUT_DIR
+
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        from .server import main as serve_main
+        return serve_main(sys.argv[2:])
+
+    parser = build_parser()
 
     load_dotenv()
     
-    args = parser.parse_args().__dict__
-    model_name: str = args.pop("model")
-    OUTPUT_DIR = args.pop("output_dir")
-    skip_vertical: bool = args.pop("skip_vertical")
-    skip_horizontal: bool = args.pop("skip_horizontal")
+    args = parser.parse_args()
+    video_paths, horizontals, options, OUTPUT_DIR = job_from_args(args)
     
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     os.makedirs(WORK_DIR, exist_ok=True)
     
-    video_paths = args.pop("video")
-        
-    if not skip_vertical:
-        create_subtitled_video(video_paths, False)
-    if not skip_horizontal:
-        create_subtitled_video(video_paths, True)
-
-def create_subtitled_video(video_paths, horizontal: bool):
-    dev_mode = False
-    aspect_str = "9x16" if not horizontal else "16x9"
-    output_file = f"{filename(video_paths[-1])}_{aspect_str}.mp4"
-    
-    if not dev_mode and os.path.exists(output_file):
+    configure_cache(int(args.cache_budget * 1024 ** 3) if args.cache_budget > 0 else None)
+    configure_model_registry(int(args.model_memory * 1024 ** 3) if args.model_memory > 0 else None)
+
+    configure_profiling(args.profile, os.path.join(WORK_DIR, "profiles"))
+    try:
+        configure_stage_limits(parse_stage_limits(args.stage_limits))
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Both aspect ratios are rendered in a single pass over the sources
+    if not args.report:
+        return create_subtitled_videos(video_paths, horizontals, options)
+
+    report = RunReport()
+    try:
+        with report_stages(report.record):
+            create_subtitled_videos(video_paths, horizontals, options)
+    finally:
+        report.write(args.report)
+
+@dataclass
+class PipelineOptions:
+    model: str = "small.en"
+    compute_type: str = "float32"
+    batch_size: int = 8
+    threads: int = 4
+    stream_audio: float = 0
+    transcribe_workers: int = 1
+    jobs: int = 1
+    caption_engine: str = "moviepy"
+    score_workers: int = 8
+    score_batch_size: int = 1
+    preview: bool = False
+    time_range: tuple = None
+
+def aspect_name(horizontal: bool):
+    return "16x9" if horizontal else "9x16"
+
+def output_size(horizontal: bool, output_scale=1.0):
+    target_w, target_h = (1920, 1080) if horizontal else (1080, 1920)
+    # Even sizes, as yuv420p needs them
+    return 2 * round(target_w * output_scale / 2), 2 * round(target_h * output_scale / 2)
+
+def build_subtitled_clip(source_clip, face_points, whisperx_json_path, horizontal: bool,
+                         caption_engine="moviepy", fps=30, output_scale=1.0):
+    import cv2
+    import numpy as np
+
+    orig_video_w, orig_video_h = source_clip.size
+    clip_fps = source_clip.fps
+    target_w, target_h = output_size(horizontal, output_scale)
+    scale = target_h / orig_video_h
+
+    # Crop window in source pixels, cut out before scaling so only the kept
+    # pixels get resized
+    crop_w = min(int(round(target_w / scale)), orig_video_w)
+    crop_h = min(int(round(target_h / scale)), orig_video_h)
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+
+    # Per-frame window offsets, clamped to the source frame once up front
+    face_x = np.asarray(face_points.x, dtype=np.float64)
+    face_y = np.asarray(face_points.y, dtype=np.float64)
+    crop_x = np.clip(np.round(face_x - crop_w / 2), 0, orig_video_w - crop_w).astype(np.int32)
+    crop_y = np.clip(np.round(face_y - crop_h / 2), 0, orig_video_h - crop_h).astype(np.int32)
+    last_index = len(face_points) - 1
+
+    def make_cropped_frame(t):
+        frame = source_clip.get_frame(t)
+        i = min(int(t * clip_fps), last_index)
+        cx, cy = crop_x[i], crop_y[i]
+        window = frame[cy:cy+crop_h, cx:cx+crop_w]
+        if window.shape[1] != target_w or window.shape[0] != target_h:
+            window = cv2.resize(window, (target_w, target_h), interpolation=interpolation)
+        return window
+
+    video_clip = source_clip.with_make_frame(make_cropped_frame)
+
+    if caption_engine == "ass":
+        from .ass import build_ffmpeg_overlays
+
+        # ffmpeg burns in the captions and overlays while encoding
+        ass_path = os.path.join(WORK_DIR, f"{filename(whisperx_json_path)}_{aspect_name(horizontal)}_{target_w}x{target_h}.ass")
+        video_clip.ffmpeg_overlays = build_ffmpeg_overlays(video_clip, whisperx_json_path, ass_path, fps)
+        return video_clip
+
+    from .emoji import build_overlays
+    from .overlay_index import IndexedCompositeVideoClip
+
+    # Captions
+    # B-roll images were already generated by the BrollPrefetcher
+    subtitle_clips = build_overlays(video_clip, whisperx_json_path, generate_broll=False, fps=fps)
+
+    # Only the overlays active at t are composited on each frame
+    return IndexedCompositeVideoClip([video_clip] + subtitle_clips)
+
+@dataclass(frozen=True)
+class PreparedInput:
+    video_path: str
+    whisperx_json_path: str
+    duration: float
+    caption_engine: str = "moviepy"
+    fps: int = 30
+    output_scale: float = 1.0
+    face_track: str = None  # cache key of the face track, which decides the crop
+
+def transcribe_input(video_path, horizontals, options: PipelineOptions, broll: "BrollPrefetcher"):
+    """Audio, transcription and B-roll of one input. Returns (whisperx_json_path, duration)."""
+    from moviepy import VideoFileClip
+
+    source_clip = VideoFileClip(video_path)
+    duration = source_clip.duration
+    source_clip.close()
+
+    if options.stream_audio:
+        # ffmpeg decodes the audio while it's being transcribed, no .wav needed
+        audio_path = video_path
+    else:
+        with stage("audio"):
+            audio_path = get_audio(video_path, WORK_DIR)
+    with stage("transcribe"):
+        whisperx_json_path = generate_and_write_whisperx_json(audio_path, WORK_DIR,
+                                                              model_size=options.model,
+                                                              score_workers=options.score_workers,
+                                                              score_batch_size=options.score_batch_size,
+                                                              compute_type=options.compute_type,
+                                                              batch_size=options.batch_size,
+                                                              threads=options.threads,
+                                                              stream_window=options.stream_audio or None,
+                                                              transcribe_workers=options.transcribe_workers)
+
+    # B-roll generation starts as soon as scores exist and overlaps everything else
+    broll.submit(whisperx_json_path, duration, [not horizontal for horizontal in horizontals])
+    return whisperx_json_path, duration
+
+def track_input(video_path):
+    """Face tracking of one input. Returns the track's cache key."""
+    from .face_tracking import track_face_centers, face_track_key
+
+    with stage("face_track"):
+        track_face_centers(video_path, work_dir=WORK_DIR)
+    return face_track_key(video_path, WORK_DIR)
+
+def prepare_inputs(video_paths, horizontals, options: PipelineOptions, broll: "BrollPrefetcher", fps=30,
+                   output_scale=1.0, audio_track=None):
+    """Prepares every input with their stages pipelined across inputs.
+
+    Transcription and face tracking of every input (and the combined audio
+    track) are independent tasks, so while one input is transcribing another
+    can be face tracking and a third extracting audio. How many run at once
+    per stage is up to the stage limits (see stages.configure_stage_limits).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    callback = get_stage_callback()
+
+    def run(fn, *args):
+        # Stage timings from pool threads go to the caller's report
+        with report_stages(callback):
+            return fn(*args)
+
+    with ThreadPoolExecutor(max_workers=min(2 * len(video_paths) + 1, PIPELINE_THREADS),
+                            thread_name_prefix="prepare") as pool:
+        transcripts, tracks = [], []
+        for video_path in video_paths:
+            transcripts.append(pool.submit(run, transcribe_input, video_path, horizontals, options, broll))
+            tracks.append(pool.submit(run, track_input, video_path))
+        if audio_track:
+            audio = pool.submit(run, write_input_audio, video_paths, audio_track)
+
+        prepared = []
+        for video_path, transcript, track in zip(video_paths, transcripts, tracks):
+            whisperx_json_path, duration = transcript.result()
+            prepared.append(PreparedInput(video_path, whisperx_json_path, duration, options.caption_engine,
+                                          fps, output_scale, track.result()))
+        if audio_track:
+            audio.result()
+    return prepared
+
+def write_input_audio(video_paths, audio_track):
+    from .render import write_audio_track
+
+    with stage("audio"):
+        write_audio_track(video_paths, audio_track)
+
+def build_input_clips(prepared: PreparedInput, horizontals):
+    from moviepy import VideoFileClip
+    from .face_tracking import track_face_centers
+
+    # A single reader is shared by every aspect ratio: the vertical and
+    # horizontal pipelines ask for the same t in turn, so the reader
+    # decodes each source frame once and hands back its last frame.
+    source_clip = VideoFileClip(prepared.video_path)
+    face_points = track_face_centers(prepared.video_path, work_dir=WORK_DIR)
+    return {
+        horizontal: build_subtitled_clip(source_clip, face_points, prepared.whisperx_json_path, horizontal,
+                                         prepared.caption_engine, prepared.fps, prepared.output_scale)
+        for horizontal in horizontals
+    }
+
+# Bump whenever the way overlays are drawn changes, so cached render chunks are invalidated
+CHUNK_VERSION = 2
+
+def chunk_fingerprint(descriptions, builder_args, horizontal, first_frame, end_frame):
+    """Describes the crop and everything drawn over the source in a chunk, see render_timeline.
+
+    `descriptions` memoizes the overlays of every (input, aspect ratio) within one render.
+    """
+    import json
+    import hashlib
+    from .emoji import describe_overlays
+
+    prepared, _ = builder_args
+    key = (prepared, horizontal)
+    if key not in descriptions:
+        descriptions[key] = describe_overlays(prepared.whisperx_json_path, prepared.duration,
+                                                       vertical=not horizontal)
+    t_start, t_end = first_frame / prepared.fps, end_frame / prepared.fps
+    active = [overlay for overlay in descriptions[key] if overlay[0] < t_end and overlay[1] > t_start]
+    description = [CHUNK_VERSION, prepared.caption_engine, output_size(horizontal, prepared.output_scale),
+                   prepared.face_track, active]
+    return hashlib.sha256(json.dumps(description, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def create_subtitled_video(video_paths, horizontal: bool, options: PipelineOptions = None, output_dir=None):
+    create_subtitled_videos(video_paths, [horizontal], options, output_dir)
+
+def create_subtitled_videos(video_paths, horizontals, options: PipelineOptions = None, output_dir=None):
+    options = options or PipelineOptions()
+    output_dir = OUTPUT_DIR if output_dir is None else output_dir
+
+    suffix = "_preview" if options.preview else ""
+    if options.time_range:
+        start, end = options.time_range
+        suffix += f"_{start:g}-{end:g}" if end is not None else f"_{start:g}-"
+
+    output_files = {}
+    for horizontal in horizontals:
+        output_file = os.path.join(output_dir, f"{filename(video_paths[-1])}_{aspect_name(horizontal)}{suffix}.mp4")
+        # Previews and ranges are meant to be re-rendered while iterating
+        if not suffix and os.path.exists(output_file):
+            continue
+        output_files[horizontal] = output_file
+
+    if not output_files:
         return
-    
-    clips = []
-    for idx, video_path in enumerate(video_paths):
-        video_clip = VideoFileClip(video_path)
-        
-        orig_video_w, orig_video_h = video_clip.size
-        clip_fps = video_clip.fps
-        target_w, target_h = (1920, 1080) if horizontal else (1080, 1920)
-        scale = target_h / orig_video_h
-        video_clip = video_clip.resized(height=target_h)
-        scaled_w, scaled_h = int(orig_video_w * scale), int(orig_video_h * scale)
-        
-        face_points = track_face_centers(video_path, work_dir=WORK_DIR)
-        
-        # this reference is needed in the make_cropped_frame def
-        resized_clip = video_clip.resized(height=target_h)
-        
-        def make_cropped_frame(t):
-            frame = resized_clip.get_frame(t)
-            i = min(int(t * clip_fps), len(face_points) - 1)
-            face_x, face_y = face_points[i].x, face_points[i].y
-            face_x_scaled = face_x * scale
-            face_y_scaled = face_y * scale
-            cx = int(min(max(face_x_scaled - target_w // 2, 0), scaled_w - target_w))
-            cy = int(min(max(face_y_scaled - target_h // 2, 0), scaled_h - target_h))
-            return frame[cy:cy+target_h, cx:cx+target_w]
-
-        video_clip = resized_clip.with_make_frame(make_cropped_frame)
-
-        audio_path = get_audio(video_path, WORK_DIR)
-        whisperx_json_path = generate_and_write_whisperx_json(audio_path, WORK_DIR)
-        
-        # Captions
-        subtitle_clips = build_overlays(video_clip, whisperx_json_path)
-
-        clip = CompositeVideoClip([video_clip] + subtitle_clips)
-        clips.append(clip)
-    
-    final = concatenate_videoclips(clips)
-
-    if dev_mode:
-        final.write_videofile(
-            os.path.join(OUTPUT_DIR, output_file),
-            fps=12,
-            bitrate="800k",         # Lower bitrate for faster rendering
-            preset="ultrafast",     # ffmpeg preset (requires ffmpeg installed)
-            audio_codec="aac",      # ensure audio is included
-            codec="h264_videotoolbox",        # Use H.264 codec for video
-            ffmpeg_params=["-movflags", "+faststart"],
-        )
+
+    if options.preview:
+        fps = PREVIEW_FPS
+        output_scale = PREVIEW_SCALE
+        encoder_settings = dict(preset="ultrafast", codec="libx264", ffmpeg_params=["-crf", "30"])
     else:
-        final.write_videofile(
-            os.path.join(OUTPUT_DIR, output_file),
-            fps=30,
-            audio_codec="aac",
-            ffmpeg_params=["-movflags", "+faststart"],
-        )
+        fps = 30
+        output_scale = 1.0
+        encoder_settings = dict(preset="medium", codec="libx264")
+
+    # Heavy imports are deferred to here so `--help` and skipped outputs stay fast
+    from .broll import BrollPrefetcher
+    from .render import render_timeline
+
+    horizontals = tuple(output_files)
+    fd, audio_track = tempfile.mkstemp(prefix=f"{filename(video_paths[-1])}_", suffix=".m4a", dir=WORK_DIR)
+    os.close(fd)
+    broll = BrollPrefetcher()
+    try:
+        prepared = prepare_inputs(video_paths, horizontals, options, broll, fps, output_scale, audio_track)
+        inputs = [((p, horizontals), p.duration, p.video_path) for p in prepared]
+
+        # Render workers only read B-roll from the cache
+        broll.wait()
+    except BaseException:
+        os.remove(audio_track)
+        raise
+    finally:
+        broll.shutdown()
+
+    descriptions = {}
+
+    def fingerprint(*args):
+        return chunk_fingerprint(descriptions, *args)
+
+    try:
+        with stage("render"):
+            render_timeline(inputs, output_files, build_input_clips, fps, jobs=options.jobs,
+                            encoder_settings=encoder_settings, audio_path=audio_track, work_dir=WORK_DIR,
+                            time_range=options.time_range, fingerprint=fingerprint)
+    finally:
+        os.remove(audio_track)
 
 if __name__ == '__main__':
     main()
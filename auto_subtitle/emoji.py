@@ -1,15 +1,18 @@
-import os
 import math
 import json
 import numpy as np
 import random
-from PIL import Image, ImageDraw, ImageFont
-from moviepy import VideoFileClip, ImageClip, TextClip, CompositeVideoClip
-from slugify import slugify
+import threading
+from PIL import Image
 from .utils import *
-import json
+from .raster_cache import get_word_raster_cache
+from .emoji_atlas import EMOJI_FONT_PATH, get_emoji_atlas
+from .cache import get_cache
+from .stages import stage, note
+
+EMOJI_INDEX_PATH = "external/emojis.json"
 
-def load_inverted_emoji_index(path="external/emojis.json"):
+def load_inverted_emoji_index(path=EMOJI_INDEX_PATH):
     with open(path) as f:
         raw = json.load(f)
 
@@ -20,27 +23,33 @@ def load_inverted_emoji_index(path="external/emojis.json"):
             inverted.setdefault(keyword, []).append(emoji)
     return inverted
 
-EMOJI_DB = load_inverted_emoji_index()
+_emoji_db = None
+
+def get_emoji_db():
+    # Built on first use rather than on import
+    global _emoji_db
+    if _emoji_db is None:
+        try:
+            _emoji_db = load_inverted_emoji_index()
+        except FileNotFoundError:
+            print(f"⚠️ No emoji index at {EMOJI_INDEX_PATH}, captions will have no emojis.")
+            _emoji_db = {}
+    return _emoji_db
 
 def get_emojis_for_word(word):
     if len(word) >= 5:
-        return EMOJI_DB.get(word.lower(), [])
+        return get_emoji_db().get(word.lower(), [])
 
-FONT_PATH = "/System/Library/Fonts/Apple Color Emoji.ttc"
-EMOJI_RENDER_DIR = "apple_emojis"
+FONT_PATH = EMOJI_FONT_PATH
 SUBTITLE_FONT = "Bangers"
-os.makedirs(EMOJI_RENDER_DIR, exist_ok=True)
-
-def emoji_to_filename(emoji):
-    return '-'.join(f"{ord(c):x}" for c in emoji) + ".png"
+CAPTION_FONT_FILE = "./Bangers-Regular.ttf"
+CAPTION_SAFE_Y_RATIO = 0.78  # visually safe from UI
+CAPTION_SAFE_WIDTH_RATIO = 0.9
+CAPTION_SAFE_HEIGHT_RATIO = 0.08
 
 def render_emoji_to_png(emoji, video_clip, path):
-    size = get_emoji_size(video_clip)
-    font = ImageFont.truetype(FONT_PATH, size, encoding='unic')
-    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(image)
-    draw.text((0, 0), emoji, font=font, embedded_color=True)
-    image.save(path)
+    rgba, _ = get_emoji_atlas().get(emoji, get_emoji_size(video_clip))
+    Image.fromarray(rgba, "RGBA").save(path)
 
 def get_emoji_size(video_clip, scale=0.05):
     preferred_sizes = [32, 64, 96, 160, 256]
@@ -48,55 +57,134 @@ def get_emoji_size(video_clip, scale=0.05):
     size = min(preferred_sizes, key=lambda s: abs(s - target))
     return size
 
-def get_emoji_overlay(video_clip, word, start, end, y_position):
-    center_x = (video_clip.w // 2) - (get_emoji_size(video_clip) // 2)
-    effect_cycle = [
-        # Smooth vertical bounce (3Hz)
-        {
-            "position": lambda t: ("center", y_position + 20 * np.sin(6 * np.pi * t)),
-            "scale": lambda t: 1.0
-        },
-        # Zoom in
-        {
-            "position": lambda t: (center_x, y_position),
-            "scale": lambda t: 0.5 + 0.5 * t
-        },
-        # Springy decay bounce (damped sine wave)
-        {
-            "position": lambda t: ("center", y_position + 40 * np.exp(-1.5 * t) * np.sin(6 * np.pi * t)),
-            "scale": lambda t: 1.0
-        },
-        # Pop bounce
-        {
-            "position": lambda t: (center_x, y_position),
-            "scale": lambda t: 1.0 + 0.3 * np.exp(-4 * t) * np.sin(10 * np.pi * t)
-        },
-        # Slide in from left
-        {
-            "position": lambda t: (int(video_clip.w * 0.1) + int(video_clip.w * 0.5 * t), y_position),
-            "scale": lambda t: 1.0
-        },
-    ]
-    
+def overlay_scale(video_clip):
+    # Pixel amounts (strokes, motion) are tuned for 1080x1920 and 1920x1080 output
+    return max(video_clip.w, video_clip.h) / 1920
+
+EMOJI_EFFECTS = ["bounce", "zoom_in", "spring", "pop", "slide_in"]
+
+def choose_emoji(word, start):
     emojis = get_emojis_for_word(word.lower())
     if not emojis:
         return None
 
-    emoji = random.choice(emojis)
-    emoji_path = path_to_emoji(emoji, video_clip)
-    fx = random.choice(effect_cycle)
+    # Seeded per word occurrence so every render process (and caption engine)
+    # picks the same emoji and effect
+    rng = random.Random(f"{word}:{start}")
+    return rng.choice(emojis), rng.choice(EMOJI_EFFECTS)
+
+# Animation curves, evaluated with NumPy over all frame times of an overlay at once.
+# `t` is seconds since the emoji appeared, `s` the overlay scale (see overlay_scale).
+# x is None for horizontally centered.
+EMOJI_ANIMATIONS = {
+    # Smooth vertical bounce (3Hz)
+    "bounce": {
+        "x": None,
+        "y": lambda t, y_position, w, s: y_position + 20 * s * np.sin(6 * np.pi * t),
+        "scale": None,
+    },
+    # Zoom in
+    "zoom_in": {
+        "x": lambda t, center_x, w, s: np.full_like(t, center_x),
+        "y": lambda t, y_position, w, s: np.full_like(t, y_position),
+        "scale": lambda t: 0.5 + 0.5 * t,
+    },
+    # Springy decay bounce (damped sine wave)
+    "spring": {
+        "x": None,
+        "y": lambda t, y_position, w, s: y_position + 40 * s * np.exp(-1.5 * t) * np.sin(6 * np.pi * t),
+        "scale": None,
+    },
+    # Pop bounce
+    "pop": {
+        "x": lambda t, center_x, w, s: np.full_like(t, center_x),
+        "y": lambda t, y_position, w, s: np.full_like(t, y_position),
+        "scale": lambda t: 1.0 + 0.3 * np.exp(-4 * t) * np.sin(10 * np.pi * t),
+    },
+    # Slide in from left
+    "slide_in": {
+        "x": lambda t, center_x, w, s: (int(w * 0.1) + (w * 0.5 * t).astype(int)).astype(float),
+        "y": lambda t, y_position, w, s: np.full_like(t, y_position),
+        "scale": None,
+    },
+}
+
+_animation_frames = {}  # (emoji, size, effect, fps) -> [(rgb, alpha)] per frame, shared between occurrences
+_animation_lock = threading.Lock()
+
+def get_animation_frames(emoji, size, effect, fps, n_frames):
+    """Pre-scaled sprite frames of an effect, frame k at t = k / fps.
+
+    Frames are cached per (emoji, size, effect, fps) and extended when a longer
+    overlay needs them. Frames that round to the same pixel size share a buffer,
+    and effects without a scale curve are a single unscaled frame.
+    """
+    scale_curve = EMOJI_ANIMATIONS[effect]["scale"]
+    if scale_curve is None:
+        rgba, alpha = get_emoji_atlas().get(emoji, size)
+        return [(rgba[:, :, :3], alpha)]
+
+    key = (emoji, size, effect, fps)
+    with _animation_lock:
+        frames = _animation_frames.setdefault(key, [])
+        if len(frames) < n_frames:
+            rgba, _ = get_emoji_atlas().get(emoji, size)
+            pixel_sizes = np.maximum(np.rint(size * scale_curve(np.arange(len(frames), n_frames) / fps)), 1).astype(int)
+            by_size = {frame[0].shape[0]: frame for frame in frames}
+            for pixels in pixel_sizes:
+                if pixels not in by_size:
+                    scaled = np.asarray(Image.fromarray(rgba, "RGBA").resize((pixels, pixels), Image.LANCZOS))
+                    by_size[pixels] = (scaled[:, :, :3], scaled[:, :, 3].astype(np.float32) / 255)
+                frames.append(by_size[pixels])
+        return frames[:n_frames]
+
+def get_emoji_overlay(video_clip, word, start, end, y_position, fps=30):
+    choice = choose_emoji(word, start)
+    if not choice:
+        return None
+
+    from moviepy import VideoClip
+
+    emoji, effect = choice
+    size = get_emoji_size(video_clip)
+    center_x = (video_clip.w // 2) - (size // 2)
+    fx = EMOJI_ANIMATIONS[effect]
+
+    n_frames = max(int(math.ceil((end - start) * fps)), 1)
+    t = np.arange(n_frames) / fps
+    frames = get_animation_frames(emoji, size, effect, fps, n_frames)
+    widths = np.array([frames[min(i, len(frames) - 1)][0].shape[1] for i in range(n_frames)])
+    s = overlay_scale(video_clip)
+    xs = (video_clip.w - widths) / 2 if fx["x"] is None else fx["x"](t, center_x, video_clip.w, s)
+    ys = fx["y"](t, y_position, video_clip.w, s)
+    positions = list(zip(xs.astype(int).tolist(), ys.astype(int).tolist()))
+
+    # Playback is an index into the precomputed frames and positions
+    def index(t):
+        return min(int(t * fps + 1e-6), n_frames - 1)
+
+    def frame(t):
+        return frames[min(index(t), len(frames) - 1)][0]
 
-    emoji_clip = (ImageClip(emoji_path)
+    def mask(t):
+        return frames[min(index(t), len(frames) - 1)][1]
+
+    emoji_clip = (VideoClip(frame, duration=end - start, has_constant_size=len(frames) == 1)
+                    .with_mask(VideoClip(mask, is_mask=True, duration=end - start,
+                                         has_constant_size=len(frames) == 1))
                     .with_start(start)
                     .with_end(end)
-                    .with_position(fx["position"])
-                    .resized(fx["scale"]))
+                    .with_position(lambda t: positions[index(t)]))
     return emoji_clip
     
 def generate_b_roll_overlay(image_path, start, end, video_size):
+    import cv2
+    from moviepy import VideoClip
+
     duration = min(max(end - start, 3), 5)
-    img_clip = ImageClip(image_path, duration=duration)
-    img_w, img_h = img_clip.size
+    with Image.open(image_path) as image:
+        source = np.asarray(image.convert("RGB"))
+    img_h, img_w = source.shape[:2]
     target_w, target_h = video_size
     
     # Compute scale to cover frame, whether 9:16 or 16:9
@@ -114,99 +202,147 @@ def generate_b_roll_overlay(image_path, start, end, video_size):
     zoom_margin = 1.25
     base_scale = scale_to_cover * zoom_margin
 
-    def zoom(t):
-        return base_scale * (1 + 0.20 * (t / duration))
+    # The source is resampled once, to the scale at the start of the zoom.
+    # Each frame is then a single affine warp of that buffer straight into an
+    # output sized frame, so per-frame work follows output pixels.
+    buffer = cv2.resize(source, (round(img_w * base_scale), round(img_h * base_scale)),
+                        interpolation=cv2.INTER_AREA if base_scale < 1 else cv2.INTER_CUBIC)
+    buffer_h, buffer_w = buffer.shape[:2]
+
+    def make_frame(t):
+        # Zoom relative to the buffer, centered like with_position("center")
+        k = 1 + 0.20 * (t / duration)
+        matrix = np.array([[k, 0, (target_w - k * buffer_w) / 2],
+                           [0, k, (target_h - k * buffer_h) / 2]], dtype=np.float64)
+        return cv2.warpAffine(buffer, matrix, (target_w, target_h), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_REPLICATE)
 
     return (
-        img_clip
-        .resized(lambda t: zoom(t))
-        .with_position("center")  # safe as long as image always covers frame
+        VideoClip(make_frame, duration=duration)
+        .with_position((0, 0))  # every frame covers the whole output
         .with_start(start)
         .with_duration(duration)
-        .with_opacity(1)
     )
 
-def build_overlays(video_clip, whisperx_json_path):
-    overlays = []
-    with open(whisperx_json_path, 'r') as f:
-        data = json.load(f)
+def build_overlays(video_clip, whisperx_json_path, generate_broll=True, fps=30):
+    with stage("overlays"):
+        overlays = []
+        with open(whisperx_json_path, 'r') as f:
+            data = json.load(f)
 
-    segments = data.get("segments", [])
+        segments = data.get("segments", [])
     
-    if not segments:
-        print("⚠️ No segments found for subtitles.")
-        return overlays
+        if not segments:
+            print("⚠️ No segments found for subtitles.")
+            return overlays
     
-    broll_overlay = find_broll_segment_and_generate_broll_overlay(video_clip, segments)
-    if broll_overlay: overlays.extend(broll_overlay)
+        broll_overlay = find_broll_segment_and_generate_broll_overlay(video_clip, segments, generate_broll)
+        if broll_overlay: overlays.extend(broll_overlay)
     
-    for segment in segments:
-        for word_info in segment.get("words", []):
-            word = word_info["word"]
-            start = word_info["start"]
-            end = word_info["end"]
+        for segment in segments:
+            for word_info in segment.get("words", []):
+                word = word_info["word"]
+                start = word_info["start"]
+                end = word_info["end"]
             
-            safe_y_ratio = 0.78  # visually safe from UI
-
-            safe_width_ratio = 0.9
-            safe_height_ratio = 0.08
-                        
-            caption_height = int(video_clip.h * safe_height_ratio)
-            word_clip = TextClip(text=word, 
-                                  font="./Bangers-Regular.ttf", 
-                                  method='caption', 
-                                  size=(int(video_clip.w * safe_width_ratio), caption_height),
-                                  horizontal_align="center",
-                                  vertical_align="center",
-                                  stroke_color="black",
-                                  stroke_width=4,
-                                  color="white")
-
-            word_clip = word_clip.with_start(start)
-            word_clip = word_clip.with_end(end)
-
-            # Convert Y-ratio to pixel position
-            y_position = int(video_clip.h * safe_y_ratio)
-            word_clip = word_clip.with_position(("center", y_position))
-
-            overlays.append(word_clip)
+                caption_height = int(video_clip.h * CAPTION_SAFE_HEIGHT_RATIO)
+                # Each distinct word is rasterized once and shared between its occurrences
+                word_clip = get_word_raster_cache().clip(word,
+                                                         font=CAPTION_FONT_FILE,
+                                                         size=(int(video_clip.w * CAPTION_SAFE_WIDTH_RATIO), caption_height),
+                                                         stroke_color="black",
+                                                         stroke_width=max(round(4 * overlay_scale(video_clip)), 1),
+                                                         color="white")
+
+                word_clip = word_clip.with_start(start)
+                word_clip = word_clip.with_end(end)
+
+                # Convert Y-ratio to pixel position
+                y_position = int(video_clip.h * CAPTION_SAFE_Y_RATIO)
+                word_clip = word_clip.with_position(("center", y_position))
+
+                overlays.append(word_clip)
             
-            emoji_end = max(end, start + 1)
-            emoji_y_position = y_position - caption_height
-            emoji_overlay = get_emoji_overlay(video_clip, word.lower(), start, emoji_end, emoji_y_position)
-            if emoji_overlay:
-                overlays.append(emoji_overlay)
+                emoji_end = max(end, start + 1)
+                emoji_y_position = y_position - caption_height
+                emoji_overlay = get_emoji_overlay(video_clip, word.lower(), start, emoji_end, emoji_y_position, fps)
+                if emoji_overlay:
+                    overlays.append(emoji_overlay)
+
+        get_emoji_atlas().save()
+        note(overlays=len(overlays))
+        return overlays
+
+def describe_overlays(whisperx_json_path, video_duration, vertical: bool):
+    """(start, end, description) of every overlay build_overlays draws, without building clips.
 
+    Used to tell which parts of a render changed: captions by word and timing,
+    emoji by choice and effect, B-roll by the content of its image.
+    """
+    with open(whisperx_json_path, 'r') as f:
+        segments = json.load(f).get("segments", [])
+
+    overlays = []
+    for segment in select_broll_segments(segments, video_duration):
+        image_path = get_broll_image(segment, vertical, generate=False)
+        if image_path:
+            start = segment.get("start", 0)
+            end = start + min(max(segment.get("end", 0) - start, 3), 5)
+            overlays.append((start, end, ("broll", get_cache().digest(image_path))))
+
+    for segment in segments:
+        for word_info in segment.get("words", []):
+            word, start, end = word_info["word"], word_info["start"], word_info["end"]
+            overlays.append((start, end, ("caption", word)))
+            choice = choose_emoji(word.lower(), start)
+            if choice:
+                overlays.append((start, max(end, start + 1), ("emoji",) + choice))
     return overlays
 
-def find_broll_segment_and_generate_broll_overlay(video_clip, segments):
+def select_broll_segments(segments, video_duration):
     # Calculate how many segments to keep
-    video_duration = video_clip.duration  # in seconds
     num_top_segments = int(math.ceil(video_duration / 30))  # 1 per 30s
     
     eligible_segments = [s for s in segments if s.get("b_roll_score", 0) >= 8 and s.get("b_roll_prompt") and s.get("emotional_tone")]
     
     # Sort and take top X
-    top_segments = sorted(
+    return sorted(
         eligible_segments, key=lambda s: s["b_roll_score"], reverse=True
     )[:num_top_segments]
-    
+
+def get_broll_image(segment, vertical: bool, generate: bool = True):
+    """Returns the cached B-roll image for a segment, generating it if allowed."""
+    cache = get_cache()
+    prompt = segment["b_roll_prompt"]
+    key = cache.key("broll_image", prompt=prompt, vertical=vertical, model="dall-e-3")
+
+    image_path = cache.lookup("broll_image", key, ".png")
+    if image_path is None and generate:
+        with cache.produce("broll_image", key, ".png") as tmp_path:
+            generate_b_roll_image(prompt, tmp_path, vertical)
+        image_path = cache.lookup("broll_image", key, ".png")
+    return image_path
+
+def find_broll_segment_and_generate_broll_overlay(video_clip, segments, generate=True):
     overlays = []
-    for segment in top_segments:
+    for segment in select_broll_segments(segments, video_clip.duration):
         start = segment.get("start", 0)
         end = segment.get("end", 0)
-        aspect_str = "9x16" if is_vertical(video_clip) else "16x9"
-        image_path = "broll_images/" + slugify(segment["b_roll_prompt"][:100]) + "_" + aspect_str + ".png"
-        if not os.path.exists(image_path):
-            generate_b_roll_image(segment["b_roll_prompt"], image_path, is_vertical(video_clip))
+        image_path = get_broll_image(segment, is_vertical(video_clip), generate)
 
-        if os.path.exists(image_path):
+        if image_path:
             overlays.append(generate_b_roll_overlay(image_path, start, end, (video_clip.w, video_clip.h)))
 
     return overlays
 
 def path_to_emoji(emoji, video_clip):
-    emoji_path = os.path.join(EMOJI_RENDER_DIR, emoji_to_filename(emoji))
-    if not os.path.exists(emoji_path):
-        render_emoji_to_png(emoji, video_clip, emoji_path)
-    return emoji_path
\ No newline at end of file
+    cache = get_cache()
+    size = get_emoji_size(video_clip)
+    key = cache.key("emoji", emoji=emoji, size=size, font=FONT_PATH)
+
+    emoji_path = cache.lookup("emoji", key, ".png")
+    if emoji_path is None:
+        with cache.produce("emoji", key, ".png") as tmp_path:
+            render_emoji_to_png(emoji, video_clip, tmp_path)
+        emoji_path = cache.path("emoji", key, ".png")
+    return emoji_path
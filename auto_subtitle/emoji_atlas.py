@@ -0,0 +1,109 @@
+import os
+import threading
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from .cache import get_cache
+from .stages import note_cache
+
+EMOJI_FONT_PATH = "/System/Library/Fonts/Apple Color Emoji.ttc"
+
+
+class EmojiAtlas:
+    """Renders each (emoji, size) sprite once.
+
+    Sprites are kept in memory as RGBA uint8 arrays together with their float
+    alpha mask, so every overlay of the same emoji shares one pixel buffer.
+    They're persisted together in a single .npz atlas in the artifact cache,
+    and fonts are loaded once per size.
+    """
+
+    def __init__(self, work_dir="work", font_path=EMOJI_FONT_PATH):
+        self.cache = get_cache(work_dir)
+        self.key = self.cache.key("emoji_atlas", font=font_path)
+        self.font_path = font_path
+        self.sprites = {}  # (emoji, size) -> (rgba, alpha)
+        self.fonts = {}
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.dirty = False
+
+    @staticmethod
+    def entry_name(emoji, size):
+        # npz member names, kept ASCII
+        return f"{size}_{'-'.join(f'{ord(c):x}' for c in emoji)}"
+
+    @staticmethod
+    def parse_entry_name(name):
+        size, codepoints = name.split("_", 1)
+        return "".join(chr(int(c, 16)) for c in codepoints.split("-")), int(size)
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        atlas_path = self.cache.lookup("emoji_atlas", self.key, ".npz")
+        if not atlas_path:
+            return
+        try:
+            with np.load(atlas_path) as data:
+                for name in data.files:
+                    self.sprites.setdefault(self.parse_entry_name(name), self._with_alpha(data[name]))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable emoji atlas {atlas_path}: {e}")
+
+    @staticmethod
+    def _with_alpha(rgba):
+        rgba.flags.writeable = False
+        return rgba, rgba[:, :, 3].astype(np.float32) / 255
+
+    def _font(self, size):
+        if size not in self.fonts:
+            self.fonts[size] = ImageFont.truetype(self.font_path, size, encoding='unic')
+        return self.fonts[size]
+
+    def get(self, emoji, size):
+        """Returns the (RGBA uint8 array, alpha float array) sprite, read-only and shared."""
+        with self.lock:
+            self._load()
+            sprite = self.sprites.get((emoji, size))
+            if sprite is not None:
+                note_cache(True)
+                return sprite
+
+            image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+            ImageDraw.Draw(image).text((0, 0), emoji, font=self._font(size), embedded_color=True)
+            sprite = self._with_alpha(np.asarray(image, dtype=np.uint8))
+            self.sprites[(emoji, size)] = sprite
+            note_cache(False)
+            self.dirty = True
+            return sprite
+
+    def save(self):
+        """Writes the atlas if new sprites were rendered, merged with what other processes saved."""
+        with self.lock:
+            if not self.dirty:
+                return
+            entries = {}
+            atlas_path = self.cache.path("emoji_atlas", self.key, ".npz")
+            if os.path.exists(atlas_path):
+                try:
+                    with np.load(atlas_path) as data:
+                        entries = {name: data[name] for name in data.files}
+                except (OSError, ValueError):
+                    pass
+            for (emoji, size), (rgba, _) in self.sprites.items():
+                entries[self.entry_name(emoji, size)] = rgba
+
+            # Counted against the cache budget like any other artifact
+            with self.cache.produce("emoji_atlas", self.key, ".npz") as tmp_path:
+                np.savez_compressed(tmp_path, **entries)
+            self.dirty = False
+
+
+_emoji_atlas = None
+
+def get_emoji_atlas() -> EmojiAtlas:
+    global _emoji_atlas
+    if _emoji_atlas is None:
+        _emoji_atlas = EmojiAtlas()
+    return _emoji_atlas
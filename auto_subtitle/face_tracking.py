@@ -1,12 +1,11 @@
-import mediapipe as mp
 import numpy as np
 from tqdm import tqdm
 from slugify import slugify
 from dataclasses import dataclass
-from typing import List, Optional
-import json
+from typing import Optional
 import os
-from scipy.ndimage import gaussian_filter1d
+from .cache import get_cache
+from .stages import note
 
 @dataclass
 class FacePoint:
@@ -14,80 +13,261 @@ class FacePoint:
     x: float
     y: float
 
-    def to_dict(self):
-        return {"frame": self.frame, "x": self.x, "y": self.y}
+class FaceTrack:
+    """Per-frame face centers as float32 arrays, indexable by frame number."""
 
-def read_from_cache(infile) -> Optional[List[FacePoint]]:
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=np.float32)
+        self.y = np.asarray(y, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, i) -> FacePoint:
+        if i < 0:
+            i += len(self)
+        return FacePoint(i, float(self.x[i]), float(self.y[i]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+def read_from_cache(infile) -> Optional[FaceTrack]:
     if not os.path.exists(infile):
         return None
-    with open(infile) as f:
-        data = json.load(f)
-    return [FacePoint(d["frame"], d["x"], d["y"]) for d in data]
+    # (n_frames, 2) float32, memory-mapped rather than parsed
+    data = np.load(infile, mmap_mode="r")
+    return FaceTrack(data[:, 0], data[:, 1])
 
-def write_to_cache(data: list[FacePoint], out_file) -> None:
-    with open(out_file, "w") as f:
-        json.dump([pt.to_dict() for pt in data], f, indent=2)
+def write_to_cache(track: FaceTrack, out_file) -> None:
+    tmp_file = f"{out_file}.{os.getpid()}.tmp.npy"
+    np.save(tmp_file, np.stack([track.x, track.y], axis=1).astype(np.float32))
+    os.replace(tmp_file, out_file)
 
-def track_face_centers(video_path, frame_sample_interval=60, work_dir="work") -> list[FacePoint]:
-    slug = slugify(os.path.splitext(os.path.basename(video_path))[0])
-    out_file = os.path.join(work_dir, f"{slug}.face_track.json")
-    
-    cached_results = read_from_cache(out_file)
-    if cached_results:
+def probe_video(video_path):
+    """(width, height, frame_count) of the first video stream, as decoded frames come out."""
+    import ffmpeg
+
+    stream = next(s for s in ffmpeg.probe(video_path)["streams"] if s["codec_type"] == "video")
+    width, height = int(stream["width"]), int(stream["height"])
+    # ffmpeg applies the rotation while decoding
+    rotation = stream.get("tags", {}).get("rotate") or next(
+        (d.get("rotation") for d in stream.get("side_data_list", []) if "rotation" in d), 0)
+    if int(float(rotation)) % 180:
+        width, height = height, width
+    if stream.get("nb_frames"):
+        frame_count = int(stream["nb_frames"])
+    else:
+        num, den = map(int, stream.get("avg_frame_rate", "0/1").split("/"))
+        frame_count = int(float(stream.get("duration", 0)) * num / den) if den else 0
+    return width, height, frame_count
+
+def read_frames(video_path, size, select=None):
+    """Decodes `video_path` with ffmpeg and yields RGB frames scaled to `size`.
+
+    With `select`, an ffmpeg select expression over the frame number n, only
+    the selected frames are scaled, converted and piped over.
+    """
+    import subprocess
+    import tempfile
+
+    width, height = size
+    filters = [f"select='{select}'"] if select else []
+    filters.append(f"scale={width}:{height}:flags=area")
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-i", video_path, "-an", "-sn",
+        "-vf", ",".join(filters), "-vsync", "0", "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
+    ]
+    frame_bytes = width * height * 3
+    # stderr goes to a file, a full pipe would stall ffmpeg on noisy streams
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            while True:
+                data = proc.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                yield np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+            if proc.wait() != 0:
+                stderr.seek(0)
+                raise IOError(f"ffmpeg failed while decoding {video_path}:\n{stderr.read().decode(errors='replace')}")
+        finally:
+            if proc.poll() is None:  # the caller stopped early
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+
+def detection_size(width, height, detection_width):
+    if not detection_width or width <= detection_width:
+        return width, height
+    # Bounding boxes are relative, so detecting on a smaller frame is enough
+    return detection_width, max(int(round(height * detection_width / width)), 1)
+
+# Adaptive sampling: shot cuts are found by comparing colour histograms of
+# consecutive thumbnails. Within a shot the detection interval doubles while
+# the face holds still and drops back when it moves.
+SHOT_THRESHOLD = 0.35
+SHOT_THUMBNAIL = (64, 36)
+MIN_SAMPLE_INTERVAL = 15
+MAX_SAMPLE_INTERVAL = 240
+FACE_MOVE_RATIO = 0.03
+
+def frame_histogram(thumbnail):
+    # 16 bins per channel, the channels offset into one 48-bin histogram
+    bins = (thumbnail >> 4).reshape(-1, 3) + np.array([0, 16, 32], dtype=np.uint8)
+    hist = np.bincount(bins.ravel(), minlength=48)
+    return hist / hist.sum()
+
+def is_shot_cut(previous_hist, hist):
+    # Total variation distance between the histograms, 0 (same) to 1 (disjoint)
+    return previous_hist is not None and 0.5 * np.abs(hist - previous_hist).sum() > SHOT_THRESHOLD
+
+def face_track_key(video_path, work_dir="work", frame_sample_interval=60, sampling="adaptive",
+                   detection_width=640):
+    """Cache key of the track of `video_path`, it changes whenever the track would."""
+    params = dict(frame_sample_interval=frame_sample_interval, sampling=sampling, detection_width=detection_width)
+    if sampling == "adaptive":
+        params.update(shot_threshold=SHOT_THRESHOLD, min_interval=MIN_SAMPLE_INTERVAL, max_interval=MAX_SAMPLE_INTERVAL)
+    return get_cache(work_dir).key("face_track", [video_path], **params)
+
+def track_face_centers(video_path, frame_sample_interval=60, work_dir="work", sampling="adaptive",
+                       detection_width=640) -> FaceTrack:
+    """Tracks the main face, sampling one frame every `frame_sample_interval`.
+
+    sampling="adaptive" (default) first finds shot cuts on a 64x36 thumbnail of
+    every frame, then detects on the first frame of every shot and sparsely
+    within stable shots: the interval starts at `frame_sample_interval` and
+    adapts to how much the face moves. Interpolation and smoothing restart at
+    every cut, so the crop jumps with the camera instead of gliding between
+    speakers.
+
+    sampling="fixed" samples one frame every `frame_sample_interval` and treats
+    the video as one shot. ffmpeg selects the sampled frames right after
+    decoding, so only those are scaled, converted and piped to Python.
+
+    Sampled frames are downscaled to `detection_width` before running the
+    detector.
+    """
+    cache = get_cache(work_dir)
+    key = face_track_key(video_path, work_dir, frame_sample_interval, sampling, detection_width)
+
+    out_file = cache.lookup("face_track", key, ".npy")
+    if out_file:
         print(f"Using cached face tracking results from {out_file}")
-        return cached_results
+        return read_from_cache(out_file)
+
+    # Tracks cached before the artifact cache were keyed by file name only, so
+    # they may belong to another video with the same name or other settings
+    slug = slugify(os.path.splitext(os.path.basename(video_path))[0])
+    for suffix in (".face_track.npy", ".face_track.json"):
+        legacy_file = os.path.join(work_dir, slug + suffix)
+        if os.path.exists(legacy_file):
+            print(f"Removing outdated face tracking results {legacy_file}")
+            os.remove(legacy_file)
     
+    # Only needed when the track isn't cached, and slow to import
+    import mediapipe as mp
+    from scipy.ndimage import gaussian_filter1d
+
     mp_face_detection = mp.solutions.face_detection
     face_detector = mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5)
 
-    import cv2
-    cap = cv2.VideoCapture(video_path)
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    width, height, frame_count_estimate = probe_video(video_path)
+    detect_size = detection_size(width, height, detection_width)
 
-    frame_idx = 0
     sampled_centers = {}
-    with tqdm(total=frame_count, desc="Tracking faces", unit="frames") as pbar:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            if frame_idx % frame_sample_interval == 0:
-                results = face_detector.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                if results.detections:
-                    bbox = results.detections[0].location_data.relative_bounding_box
-                    x_center = (bbox.xmin + bbox.width / 2) * width
-                    y_center = (bbox.ymin + bbox.height / 2) * height
-                    sampled_centers[frame_idx] = (x_center, y_center)
-
-            frame_idx += 1
-            pbar.update(1)
-
-    cap.release()
-
-    # Interpolation and smoothing
+    shot_starts = [0]
+
+    def detect(frame_idx, frame):
+        # frame is RGB at detect_size
+        results = face_detector.process(frame)
+        if results.detections:
+            bbox = results.detections[0].location_data.relative_bounding_box
+            x_center = (bbox.xmin + bbox.width / 2) * width
+            y_center = (bbox.ymin + bbox.height / 2) * height
+            sampled_centers[frame_idx] = (x_center, y_center)
+
+    if sampling == "adaptive":
+        # Pass 1: every frame as a thumbnail, cuts land on their exact frame
+        previous_hist = None
+        frame_count = 0
+        with tqdm(total=frame_count_estimate, desc="Finding shot cuts", unit="frames") as pbar:
+            for thumbnail in read_frames(video_path, SHOT_THUMBNAIL):
+                hist = frame_histogram(thumbnail)
+                if is_shot_cut(previous_hist, hist):
+                    shot_starts.append(frame_count)
+                previous_hist = hist
+                frame_count += 1
+                pbar.update(1)
+
+        # Pass 2: detection frames come from a grid at the shortest interval
+        # plus the first frame of every shot, the interval picks among them
+        cut_frames = [start for start in shot_starts if start % MIN_SAMPLE_INTERVAL]
+        select = "+".join([f"not(mod(n,{MIN_SAMPLE_INTERVAL}))"] + [f"eq(n,{n})" for n in cut_frames])
+        candidates = sorted(set(range(0, frame_count, MIN_SAMPLE_INTERVAL)) | set(cut_frames))
+        new_shots = set(shot_starts)
+        interval = frame_sample_interval
+        next_detection = 0
+        last_center = None
+        with tqdm(total=len(candidates), desc="Tracking faces", unit="samples") as pbar:
+            for frame_idx, frame in zip(candidates, read_frames(video_path, detect_size, select=select)):
+                pbar.update(1)
+                if frame_idx in new_shots:
+                    interval, last_center = frame_sample_interval, None
+                elif frame_idx < next_detection:
+                    continue
+                detect(frame_idx, frame)
+                center = sampled_centers.get(frame_idx)
+                if center and last_center:
+                    moved = np.hypot(center[0] - last_center[0], center[1] - last_center[1])
+                    if moved > FACE_MOVE_RATIO * width:
+                        interval = max(interval // 2, MIN_SAMPLE_INTERVAL)
+                    else:
+                        interval = min(interval * 2, MAX_SAMPLE_INTERVAL)
+                last_center = center or last_center
+                next_detection = frame_idx + interval
+    else:
+        frame_count = frame_count_estimate
+        with tqdm(total=frame_count, desc="Tracking faces", unit="frames") as pbar:
+            frames = read_frames(video_path, detect_size, select=f"not(mod(n,{frame_sample_interval}))")
+            for i, frame in enumerate(frames):
+                frame_idx = i * frame_sample_interval
+                detect(frame_idx, frame)
+                pbar.update(max(min(frame_sample_interval, frame_count - frame_idx), 0))
+
+    # The probed frame count can be an estimate
+    frame_count = max(frame_count, max(sampled_centers, default=-1) + 1)
+    note(frames=frame_count, detections=len(sampled_centers), shots=len(shot_starts))
+
+    # Interpolation and smoothing, per shot so nothing bleeds across a cut
     x_raw = np.full(frame_count, np.nan)
     y_raw = np.full(frame_count, np.nan)
     for i, (x, y) in sampled_centers.items():
         x_raw[i] = x
         y_raw[i] = y
 
-    if np.any(~np.isnan(x_raw)):
-        # Interpolate missing values
-        x_interp = np.interp(np.arange(frame_count), np.flatnonzero(~np.isnan(x_raw)), x_raw[~np.isnan(x_raw)])
-        y_interp = np.interp(np.arange(frame_count), np.flatnonzero(~np.isnan(y_raw)), y_raw[~np.isnan(y_raw)])
-    else:
-        # No detections at all: center
-        x_interp = np.full(frame_count, width / 2)
-        y_interp = np.full(frame_count, height / 2)
+    x_smooth = np.empty(frame_count)
+    y_smooth = np.empty(frame_count)
+    for start, end in zip(shot_starts, shot_starts[1:] + [frame_count]):
+        if end <= start:
+            continue
+        x_shot, y_shot = x_raw[start:end], y_raw[start:end]
+        found = np.flatnonzero(~np.isnan(x_shot))
+        if len(found):
+            # Interpolate missing values
+            frames = np.arange(end - start)
+            x_interp = np.interp(frames, found, x_shot[found])
+            y_interp = np.interp(frames, found, y_shot[found])
+        else:
+            # No detections in this shot: center
+            x_interp = np.full(end - start, width / 2)
+            y_interp = np.full(end - start, height / 2)
 
-    # Apply smoothing
-    x_smooth = gaussian_filter1d(x_interp, sigma=2)
-    y_smooth = gaussian_filter1d(y_interp, sigma=2)
+        # Apply smoothing
+        x_smooth[start:end] = gaussian_filter1d(x_interp, sigma=2, mode="nearest")
+        y_smooth[start:end] = gaussian_filter1d(y_interp, sigma=2, mode="nearest")
 
-    result = [FacePoint(i, float(x), float(y)) for i, (x, y) in enumerate(zip(x_smooth, y_smooth))]
-    write_to_cache(result, out_file)
+    result = FaceTrack(x_smooth, y_smooth)
+    with cache.produce("face_track", key, ".npy") as tmp_file:
+        write_to_cache(result, tmp_file)
     return result
     
@@ -0,0 +1,113 @@
+import gc
+import os
+import threading
+from collections import OrderedDict
+
+# Rough parameter counts, used to estimate resident memory for eviction
+WHISPER_PARAMS = {
+    "tiny": 39e6, "base": 74e6, "small": 244e6, "medium": 769e6,
+    "large": 1550e6, "turbo": 809e6,
+}
+ALIGN_PARAMS = 95e6
+BYTES_PER_PARAM = {"int8": 1, "int8_float16": 1, "int8_float32": 1, "float16": 2, "float32": 4}
+
+def asr_bytes(model_size, compute_type):
+    base_size = model_size.split(".")[0].split("-")[0]
+    return WHISPER_PARAMS.get(base_size, WHISPER_PARAMS["large"]) * BYTES_PER_PARAM.get(compute_type, 4)
+
+
+class ModelRegistry:
+    """Keeps WhisperX ASR and alignment models loaded across videos.
+
+    Models are loaded on first use and stay resident, least recently used
+    first out once their estimated footprint exceeds `memory_budget_bytes`.
+    Transcription worker pools count with the models of all their workers and
+    are shut down when they're evicted.
+    """
+
+    def __init__(self, memory_budget_bytes=None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.models = OrderedDict()  # key -> (model, estimated bytes)
+        self.lock = threading.Lock()
+
+    def _get(self, key, estimated_bytes, load):
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key][0]
+
+            self._evict(estimated_bytes)
+            model = load()
+            self.models[key] = (model, estimated_bytes)
+            return model
+
+    def _evict(self, incoming_bytes):
+        if self.memory_budget_bytes is None:
+            return
+        freed = False
+        while self.models and sum(size for _, size in self.models.values()) + incoming_bytes > self.memory_budget_bytes:
+            key, (model, _) = self.models.popitem(last=False)
+            print(f"Unloading {key[0]} model {key[1]} to stay within the model memory budget")
+            _release(model)
+            freed = True
+        if freed:
+            gc.collect()
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+    def asr(self, model_size, device, compute_type="float32", threads=4):
+        import whisperx
+
+        estimated = asr_bytes(model_size, compute_type)
+
+        def load():
+            print(f"Loading WhisperX model {model_size} on {device} ({compute_type}, {threads} threads)...")
+            return whisperx.load_model(model_size, device=device, compute_type=compute_type, threads=threads)
+
+        return self._get(("asr", model_size, device, compute_type, threads), estimated, load)
+
+    def align(self, language_code, device):
+        import whisperx
+
+        def load():
+            print(f"Loading alignment model for '{language_code}' on {device}...")
+            return whisperx.load_align_model(language_code=language_code, device=device)
+
+        return self._get(("align", language_code, device), ALIGN_PARAMS * 4, load)
+
+    def transcription_pool(self, model_size, compute_type="float32", workers=None, threads=None):
+        """Process pool where every worker holds its own CPU copy of the Whisper model."""
+        from .transcription import start_transcription_pool
+
+        workers = workers or os.cpu_count() or 1
+        # Split the cores between workers instead of oversubscribing them
+        threads = threads or max((os.cpu_count() or 1) // workers, 1)
+        return self._get(("transcription_pool", model_size, "cpu", compute_type, workers, threads),
+                         asr_bytes(model_size, compute_type) * workers,
+                         lambda: start_transcription_pool(model_size, compute_type, workers, threads))
+
+    def clear(self):
+        with self.lock:
+            for model, _ in self.models.values():
+                _release(model)
+            self.models.clear()
+        gc.collect()
+
+def _release(model):
+    # Worker pools hold their models in other processes. Chunks already
+    # submitted still finish, the workers exit after them.
+    if hasattr(model, "shutdown"):
+        model.shutdown(wait=False)
+
+
+_registry = ModelRegistry()
+
+def get_model_registry() -> ModelRegistry:
+    return _registry
+
+def configure_model_registry(memory_budget_bytes):
+    _registry.memory_budget_bytes = memory_budget_bytes
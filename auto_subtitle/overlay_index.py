@@ -0,0 +1,58 @@
+import math
+from moviepy import CompositeVideoClip
+
+
+class OverlayIndex:
+    """Time-bucketed interval index over clips.
+
+    Every clip is registered in the buckets its [start, end) interval covers, so
+    looking up the clips playing at `t` only touches the clips in one bucket
+    instead of the whole list. Clips keep their original (z-)order.
+    """
+
+    def __init__(self, clips, bucket_seconds=1.0):
+        self.clips = list(clips)
+        self.bucket_seconds = bucket_seconds
+
+        finite_ends = [c.end for c in self.clips if c.end is not None]
+        horizon = max(finite_ends + [c.start for c in self.clips] + [0])
+        self.buckets = [[] for _ in range(int(horizon // bucket_seconds) + 1)]
+        for i, clip in enumerate(self.clips):
+            first = int(clip.start // bucket_seconds)
+            if clip.end is None:
+                last = len(self.buckets) - 1
+            else:
+                last = min(int(math.ceil(clip.end / bucket_seconds)), len(self.buckets) - 1)
+            for bucket in self.buckets[first:last + 1]:
+                bucket.append(i)
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __iter__(self):
+        return iter(self.clips)
+
+    def __getitem__(self, i):
+        return self.clips[i]
+
+    def _bucket(self, t):
+        return self.buckets[min(max(int(t // self.bucket_seconds), 0), len(self.buckets) - 1)]
+
+    def active(self, t):
+        return [self.clips[i] for i in self._bucket(t) if self.clips[i].is_playing(t)]
+
+
+class IndexedCompositeVideoClip(CompositeVideoClip):
+    """CompositeVideoClip that only composites the clips active at `t`.
+
+    Drop-in replacement: takes the same `[video_clip] + overlays` list.
+    """
+
+    def __init__(self, clips, *args, **kwargs):
+        super().__init__(clips, *args, **kwargs)
+        self.index = OverlayIndex(self.clips)
+        if isinstance(self.mask, CompositeVideoClip):
+            self.mask.playing_clips = OverlayIndex(self.mask.clips).active
+
+    def playing_clips(self, t=0):
+        return self.index.active(t)
@@ -0,0 +1,124 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from moviepy import ImageClip, TextClip
+from .stages import note_cache
+
+RASTER_DISK_BUDGET_BYTES = 512 * 1024 ** 2
+
+
+class WordRasterCache:
+    """Renders each distinct caption word once.
+
+    Rasters are kept in an in-memory LRU and persisted as .npz files, so a word is
+    rasterized once per (word, font, size, stroke, colors) across aspect ratios,
+    render workers and runs. The files are too many and too small for the
+    artifact cache manifest, so they're kept under `max_disk_bytes` on their
+    own, least recently used (by mtime) first out.
+    """
+
+    def __init__(self, cache_dir="work/text_rasters", max_entries=4096, max_disk_bytes=RASTER_DISK_BUDGET_BYTES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_bytes = None  # measured on the first store
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(word, font, size, stroke_color, stroke_width, color):
+        raw = "\0".join(map(str, ("caption", word, font, size, stroke_color, stroke_width, color)))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, word, font, size, stroke_color="black", stroke_width=4, color="white"):
+        """Returns (rgb uint8 array, alpha float array) for the rendered word."""
+        key = self.key(word, font, size, stroke_color, stroke_width, color)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                note_cache(True)
+                return self.entries[key]
+
+        path = os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+        try:
+            with np.load(path) as data:
+                raster = (data["rgb"], data["alpha"])
+            os.utime(path)  # marks it as recently used
+            note_cache(True)
+        except FileNotFoundError:
+            raster = self._render(word, font, size, stroke_color, stroke_width, color)
+            self._store(path, raster)
+            note_cache(False)
+
+        with self.lock:
+            self.entries[key] = raster
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return raster
+
+    def clip(self, word, font, size, stroke_color="black", stroke_width=4, color="white"):
+        rgb, alpha = self.get(word, font, size, stroke_color, stroke_width, color)
+        return ImageClip(rgb).with_mask(ImageClip(alpha, is_mask=True))
+
+    @staticmethod
+    def _render(word, font, size, stroke_color, stroke_width, color):
+        text_clip = TextClip(text=word,
+                             font=font,
+                             method='caption',
+                             size=size,
+                             horizontal_align="center",
+                             vertical_align="center",
+                             stroke_color=stroke_color,
+                             stroke_width=stroke_width,
+                             color=color)
+        rgb = np.ascontiguousarray(text_clip.get_frame(0), dtype=np.uint8)
+        alpha = np.ascontiguousarray(text_clip.mask.get_frame(0), dtype=np.float32)
+        text_clip.close()
+        return rgb, alpha
+
+    def _store(self, path, raster):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        rgb, alpha = raster
+        # Write under a temporary name so concurrent workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez_compressed(tmp_path, rgb=rgb, alpha=alpha)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            if self.disk_bytes is None or self.disk_bytes > self.max_disk_bytes:
+                self._prune()
+            else:
+                self.disk_bytes += os.path.getsize(path)
+
+    def _prune(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # pruned by another worker
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        # Down to 90% of the budget, so it doesn't have to run again after every store
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.disk_bytes = total
+
+
+_word_raster_cache = None
+
+def get_word_raster_cache() -> WordRasterCache:
+    global _word_raster_cache
+    if _word_raster_cache is None:
+        _word_raster_cache = WordRasterCache()
+    return _word_raster_cache
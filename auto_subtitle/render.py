@@ -0,0 +1,302 @@
+import os
+import bisect
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import ffmpeg
+import numpy as np
+from tqdm import tqdm
+from .stages import note
+from .cache import get_cache, cache_budget, configure_cache
+
+
+class FrameWriter:
+    """Pipes raw RGB frames into an ffmpeg encoder process."""
+
+    def __init__(self, path, size, fps, audio_path=None, codec="libx264", preset="medium",
+                 bitrate=None, ffmpeg_params=(), extra_inputs=(), filter_complex=None):
+        self.path = path
+        self.size = size
+        width, height = size
+
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-vcodec", "rawvideo",
+            "-s", f"{width}x{height}", "-pix_fmt", "rgb24", "-r", f"{fps:.02f}",
+            "-i", "-",
+        ]
+        # Additional inputs (overlay images) are numbered from 1, the audio comes after them
+        for input_args in extra_inputs:
+            cmd += list(input_args)
+        if audio_path:
+            cmd += ["-i", audio_path]
+        if filter_complex:
+            # setpts in the graph drops the frame rate, without -r the output falls back to 25 fps
+            cmd += ["-filter_complex", filter_complex, "-map", "[vout]", "-r", f"{fps:.02f}"]
+            if audio_path:
+                cmd += ["-map", f"{len(extra_inputs) + 1}:a"]
+        if audio_path:
+            cmd += ["-acodec", "copy"]
+        cmd += ["-vcodec", codec, "-preset", preset, "-pix_fmt", "yuv420p"]
+        if bitrate:
+            cmd += ["-b:v", bitrate]
+        cmd += list(ffmpeg_params)
+        cmd.append(path)
+
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.PIPE)
+
+    def write_frame(self, frame):
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        try:
+            self.proc.stdin.write(frame.tobytes())
+        except (BrokenPipeError, OSError):
+            error = self.proc.stderr.read().decode(errors="replace")
+            raise IOError(f"ffmpeg failed while writing {self.path}:\n{error}")
+
+    def close(self):
+        if self.proc is None:
+            return
+        self.proc.stdin.close()
+        error = self.proc.stderr.read().decode(errors="replace")
+        self.proc.stderr.close()
+        returncode = self.proc.wait()
+        self.proc = None
+        if returncode != 0:
+            raise IOError(f"ffmpeg exited with {returncode} for {self.path}:\n{error}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_audio_track(video_paths, output_file):
+    """Concatenates the audio of all inputs into a single AAC track."""
+    streams = [ffmpeg.input(path).audio for path in video_paths]
+    audio = streams[0] if len(streams) == 1 else ffmpeg.concat(*streams, v=0, a=1)
+    ffmpeg.output(audio, output_file, acodec="aac").run(quiet=True, overwrite_output=True)
+    return output_file
+
+
+# Chunks are encoded with a fixed encoder thread count and a chunk plan that
+# doesn't depend on --jobs, so serial and parallel renders produce the same
+# frames and the same bitstream.
+CHUNK_SECONDS = 30
+ENCODER_THREADS = 4
+
+def probe_keyframes(path):
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+        "-show_entries", "frame=pts_time", "-of", "csv=p=0", path,
+    ]
+    try:
+        output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    keyframes = []
+    for line in output.splitlines():
+        try:
+            keyframes.append(float(line.strip().strip(",")))
+        except ValueError:
+            continue
+    return sorted(keyframes)
+
+def plan_chunks(duration, fps, keyframes=(), chunk_seconds=CHUNK_SECONDS):
+    """Splits [0, duration) into frame ranges, snapping cuts to source keyframes when close."""
+    n_frames = int(duration * fps)
+    if n_frames == 0:
+        return []
+
+    n_chunks = max(1, round(duration / chunk_seconds))
+    keyframe_indices = sorted({round(k * fps) for k in keyframes if 0 < round(k * fps) < n_frames})
+    tolerance = chunk_seconds * fps / 4
+
+    boundaries = [0]
+    for i in range(1, n_chunks):
+        target = round(i * n_frames / n_chunks)
+        if keyframe_indices:
+            pos = bisect.bisect_left(keyframe_indices, target)
+            candidates = keyframe_indices[max(pos - 1, 0):pos + 1]
+            nearest = min(candidates, key=lambda k: abs(k - target))
+            if abs(nearest - target) <= tolerance:
+                target = nearest
+        if target > boundaries[-1]:
+            boundaries.append(target)
+    if boundaries[-1] != n_frames:
+        boundaries.append(n_frames)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+# Clips built by a render worker process, reused across chunks of the same input.
+# Serial renders pass their own dict, as several jobs may render in one process.
+_built_clips = {}
+
+def _get_clips(builder, builder_args, built_clips):
+    key = (builder, builder_args)
+    if key not in built_clips:
+        release_clips(built_clips)
+        built_clips[key] = builder(*builder_args)
+    return built_clips[key]
+
+def release_clips(built_clips=None):
+    built_clips = _built_clips if built_clips is None else built_clips
+    for clips in built_clips.values():
+        for clip in clips.values():
+            clip.close()
+    built_clips.clear()
+
+def render_chunk(builder, builder_args, frames, fps, chunk_paths, encoder_settings, built_clips=None):
+    clips = _get_clips(builder, builder_args, _built_clips if built_clips is None else built_clips)
+    first_frame, end_frame = frames
+    writers = {}
+    try:
+        for key, path in chunk_paths.items():
+            settings = dict(encoder_settings)
+            settings["ffmpeg_params"] = list(settings.get("ffmpeg_params", ())) + ["-threads", str(ENCODER_THREADS)]
+            # Clips from the ASS caption engine carry their overlays as an ffmpeg filter graph
+            ffmpeg_overlays = getattr(clips[key], "ffmpeg_overlays", None)
+            if ffmpeg_overlays is not None:
+                extra_inputs, filter_complex = ffmpeg_overlays.filter_for_range(first_frame / fps, end_frame / fps)
+                settings.update(extra_inputs=extra_inputs, filter_complex=filter_complex)
+            writers[key] = FrameWriter(path, clips[key].size, fps, **settings)
+
+        for frame_index in range(first_frame, end_frame):
+            t = frame_index / fps
+            # Every output reads the same t in turn, so the shared source decodes it once.
+            # Outputs whose chunk was reused from the cache have no writer.
+            for key, writer in writers.items():
+                writer.write_frame(clips[key].get_frame(t))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return chunk_paths
+
+def concat_chunks(chunk_paths, output_file, audio_path=None, audio_offset=0):
+    list_file = output_file + ".chunks.txt"
+    with open(list_file, "w") as f:
+        for path in chunk_paths:
+            escaped = os.path.abspath(path).replace("'", r"'\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_file]
+    if audio_path:
+        if audio_offset:
+            cmd += ["-ss", f"{audio_offset:.3f}"]
+        cmd += ["-i", audio_path, "-map", "0:v", "-map", "1:a", "-shortest"]
+    # Written next to the output and renamed when complete, a failed concat must not
+    # leave a truncated file that later runs take for a finished one
+    root, ext = os.path.splitext(output_file)
+    tmp_file = f"{root}.{os.getpid()}.tmp{ext}"
+    cmd += ["-c", "copy", "-movflags", "+faststart", tmp_file]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+        os.replace(tmp_file, output_file)
+    except subprocess.CalledProcessError as e:
+        raise IOError(f"ffmpeg concat failed for {output_file}:\n{e.stderr.decode(errors='replace')}")
+    finally:
+        os.remove(list_file)
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def render_timeline(inputs, output_files, builder, fps, jobs=1, encoder_settings=None,
+                    audio_path=None, work_dir="work", time_range=None, fingerprint=None):
+    """Renders a sequence of inputs into one file per output key.
+
+    `inputs` is a list of (builder_args, duration, source_path). `builder(*builder_args)`
+    must return a dict mapping every key of `output_files` to a clip and be importable
+    from a worker process. `time_range` (start, end) in seconds of the combined
+    timeline renders only that window (end None for the rest).
+
+    With `fingerprint(builder_args, key, first_frame, end_frame)`, describing
+    what's drawn on top of the source in that frame range, encoded chunks are
+    kept in the artifact cache. Chunks whose source, frames, settings and
+    fingerprint are unchanged are reused as-is and only the others are rendered.
+    """
+    encoder_settings = encoder_settings or {}
+    chunk_dir = os.path.join(work_dir, "chunks")
+    os.makedirs(chunk_dir, exist_ok=True)
+    cache = get_cache(work_dir) if fingerprint else None
+
+    range_start, range_end = 0, None
+    if time_range:
+        range_start = round(time_range[0] * fps)
+        range_end = round(time_range[1] * fps) if time_range[1] is not None else None
+
+    tasks = []
+    chunk_lists = {key: [] for key in output_files}
+    chunk_keys = {}  # freshly rendered chunk path -> cache key
+    reused = 0
+    offset = 0  # first frame of the input on the combined timeline
+    for input_idx, (builder_args, duration, source_path) in enumerate(inputs):
+        # The chunk plan doesn't depend on the range, a range only trims chunks
+        chunks = plan_chunks(duration, fps, probe_keyframes(source_path))
+        n_frames = chunks[-1][1] if chunks else 0
+        for chunk_idx, (start, end) in enumerate(chunks):
+            start = max(start, range_start - offset)
+            end = end if range_end is None else min(end, range_end - offset)
+            if start >= end:
+                continue
+            frames = (start, end)
+            chunk_paths = {}
+            for key, output_file in output_files.items():
+                if cache:
+                    chunk_key = cache.key("render_chunk", [source_path], frames=frames, fps=fps,
+                                          encoder=encoder_settings, encoder_threads=ENCODER_THREADS,
+                                          overlays=fingerprint(builder_args, key, start, end))
+                    cached_path = cache.lookup("render_chunk", chunk_key, ".mp4")
+                    if cached_path:
+                        chunk_lists[key].append(cached_path)
+                        reused += 1
+                        continue
+                name = f"{os.path.splitext(os.path.basename(output_file))[0]}_{input_idx:03d}_{chunk_idx:05d}.mp4"
+                chunk_paths[key] = os.path.join(chunk_dir, name)
+                chunk_lists[key].append(chunk_paths[key])
+                if cache:
+                    chunk_keys[chunk_paths[key]] = chunk_key
+            if chunk_paths:
+                tasks.append((builder, builder_args, frames, fps, chunk_paths, encoder_settings))
+        offset += n_frames
+
+    if not any(chunk_lists.values()):
+        raise ValueError(f"Nothing to render in {time_range}, the timeline is {offset / fps:.1f}s long")
+    if reused:
+        print(f"♻️ Reusing {reused} unchanged chunks, rendering {sum(len(t[4]) for t in tasks)}")
+
+    try:
+        total_frames = sum(end - start for _, _, (start, end), *_ in tasks)
+        note(frames=total_frames, chunks=len(tasks), reused_chunks=reused)
+        with tqdm(total=total_frames, desc="Rendering", unit="frames") as pbar:
+            if jobs <= 1:
+                built_clips = {}
+                try:
+                    for task in tasks:
+                        render_chunk(*task, built_clips=built_clips)
+                        pbar.update(task[2][1] - task[2][0])
+                finally:
+                    release_clips(built_clips)
+            else:
+                # Spawned workers start with the default cache budget, not the one set by --cache-budget
+                with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=configure_cache, initargs=(cache_budget(),)) as pool:
+                    futures = {pool.submit(render_chunk, *task): task for task in tasks}
+                    for future in as_completed(futures):
+                        future.result()
+                        start, end = futures[future][2]
+                        pbar.update(end - start)
+
+        # Unchanged chunks are spliced in without re-encoding
+        for key, output_file in output_files.items():
+            concat_chunks(chunk_lists[key], output_file, audio_path, audio_offset=range_start / fps)
+
+        # Stored only after the concat, so evicting to make room can't remove a chunk still needed above
+        for path, chunk_key in chunk_keys.items():
+            with cache.produce("render_chunk", chunk_key, ".mp4") as tmp_path:
+                os.replace(path, tmp_path)
+    finally:
+        # Rendered chunks that didn't make it into the cache; cached ones are kept
+        for paths in chunk_lists.values():
+            for path in paths:
+                if path.startswith(chunk_dir) and os.path.exists(path):
+                    os.remove(path)
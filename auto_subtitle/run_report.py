@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import time
+import threading
+from .stages import peak_rss_mb
+
+
+class RunReport:
+    """Collects stage records (see stages.stage) into a JSON report of a run.
+
+    Pass `record` to stages.report_stages(). The report has every stage in the
+    order it finished, plus totals per stage name, so runs can be compared to
+    find regressions.
+    """
+
+    def __init__(self, argv=None):
+        self.argv = list(sys.argv if argv is None else argv)
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def record(self, timing):
+        with self.lock:
+            self.stages.append(dict(timing))
+
+    def totals(self):
+        totals = {}
+        for timing in self.stages:
+            total = totals.setdefault(timing["stage"], {
+                "count": 0, "seconds": 0.0, "cpu_seconds": 0.0, "waited": 0.0, "cache": {"hits": 0, "misses": 0},
+            })
+            total["count"] += 1
+            for field in ("seconds", "cpu_seconds", "waited"):
+                total[field] = round(total[field] + timing.get(field, 0), 3)
+            for field in ("hits", "misses"):
+                total["cache"][field] += timing.get("cache", {}).get(field, 0)
+            if timing.get("frames"):
+                total["frames"] = total.get("frames", 0) + timing["frames"]
+        for total in totals.values():
+            if total.get("frames") and total["seconds"] > 0:
+                total["fps"] = round(total["frames"] / total["seconds"], 1)
+        return totals
+
+    def as_dict(self):
+        with self.lock:
+            peak, peak_child = peak_rss_mb()
+            return {
+                "argv": self.argv,
+                "started_at": self.started_at,
+                "seconds": round(time.perf_counter() - self.started, 3),
+                "peak_rss_mb": peak,
+                "peak_child_rss_mb": peak_child,
+                "totals": self.totals(),
+                "stages": list(self.stages),
+            }
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+        print(f"📊 Run report written to {path}")
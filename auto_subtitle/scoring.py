@@ -0,0 +1,158 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .cache import get_cache
+
+# Bump whenever the prompts below change so cached scores are invalidated
+PROMPT_VERSION = 1
+SCORING_MODEL = "gpt-4"
+
+BROLL_SYSTEM_PROMPT = """
+    You are a visual assistant trained to select B-roll and supplemental imagery to enhance podcast or YouTube content.
+
+    Your job is to evaluate whether a given segment can be represented effectively by a single cinematic image. If so, suggest a strong, metaphorical or thematic visual — not a literal one.
+
+    Focus on abstract or emotionally resonant ideas. Avoid clichés and generic imagery. Use simple, evocative phrases like: “waves crashing,” “man standing in a doorway,” or “fog rolling over mountains.”
+
+    Never suggest text overlays. Assume the final use is silent B-roll under voiceover.
+    """
+
+BROLL_ANSWER_FORMAT = """
+    - a key `"score"` (an integer from 0 to 10), indicating how visual the moment is.
+    - a key `"emotional_tone"` (a single word, lower case) that is null or captures the emotional tone of the moment, adhering strictly Plutchik’s Wheel of Emotions ("joy", "sadness", "anticipation", "fear", "anger", "disgust", "surprise", "trust"). Don't use any other words or phrases.
+    - a key `"prompt"` only if the score is 8 or above — this should describe a cinematic visual metaphor for the moment, not a literal rephrasing.
+"""
+
+BROLL_EXAMPLES = """
+    {{ "score": 8, "emotional_tone": "anticipation", "prompt": "A person journaling in a quiet forest clearing, with sunlight breaking through the trees." }},
+    {{ "score": 3, "emotional_tone": null, "prompt": null }}
+"""
+
+def broll_user_prompt(segment_text: str) -> str:
+    return f"""
+    Evaluate the following transcript segment and rate how suitable it is for representing with a single cinematic B-roll image.
+
+    Return a JSON object with:{BROLL_ANSWER_FORMAT}
+    Segment:
+    `{segment_text}`
+
+    Examples:{BROLL_EXAMPLES.format()}"""
+
+def broll_batch_user_prompt(segment_texts) -> str:
+    segments = "\n".join(f"    {i}: `{text}`" for i, text in enumerate(segment_texts))
+    return f"""
+    Evaluate each of the following transcript segments and rate how suitable it is for representing with a single cinematic B-roll image.
+
+    Return a JSON array with one object per segment, in the same order, each with a key `"index"` (the segment number) and:{BROLL_ANSWER_FORMAT}
+    Segments:
+{segments}
+
+    Examples of objects:{BROLL_EXAMPLES.format()}"""
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_openai_client():
+    # One client (and connection pool) shared by every request. It honours
+    # OPENAI_BASE_URL, which is how a local mock server can stand in for the API.
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI()
+    return _client
+
+def parse_json_answer(answer: str):
+    answer = answer.strip()
+    if answer.startswith("```"):
+        answer = answer.strip("`")
+        if answer.startswith("json"):
+            answer = answer[len("json"):]
+    return json.loads(answer)
+
+def normalize_answer(answer) -> dict:
+    if not isinstance(answer, dict):
+        raise ValueError(f"expected a JSON object, got {answer!r}")
+    return {
+        "score": int(answer.get("score") or 0),
+        "emotional_tone": answer.get("emotional_tone"),
+        "prompt": answer.get("prompt"),
+    }
+
+def request_scores(segment_texts, max_retries=4, backoff=1.0):
+    """Scores a batch of segment texts in one request, retrying transient and malformed replies."""
+    if len(segment_texts) == 1:
+        user_prompt = broll_user_prompt(segment_texts[0])
+    else:
+        user_prompt = broll_batch_user_prompt(segment_texts)
+
+    for attempt in range(max_retries + 1):
+        try:
+            response = get_openai_client().chat.completions.create(
+                model=SCORING_MODEL,
+                messages=[
+                    {"role": "system", "content": BROLL_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_prompt}
+                ]
+            )
+            answer = parse_json_answer(response.choices[0].message.content)
+            if len(segment_texts) == 1:
+                return [normalize_answer(answer)]
+
+            by_index = {int(a["index"]): normalize_answer(a) for a in answer}
+            if sorted(by_index) != list(range(len(segment_texts))):
+                raise ValueError(f"expected {len(segment_texts)} answers, got indices {sorted(by_index)}")
+            return [by_index[i] for i in range(len(segment_texts))]
+        except Exception as e:
+            if attempt == max_retries:
+                print(f"⚠️ Giving up scoring {len(segment_texts)} segment(s): {e}")
+                return None
+            delay = backoff * 2 ** attempt + random.uniform(0, backoff)
+            print(f"⚠️ Scoring failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+def score_cache_key(cache, segment_text):
+    return cache.key("broll_score", text=segment_text, prompt_version=PROMPT_VERSION, model=SCORING_MODEL)
+
+def score_segments(segment_texts, work_dir="work", max_workers=8, batch_size=1):
+    """Returns one B-roll answer per segment text.
+
+    Answers are cached by segment text and prompt version. Misses are sent
+    `batch_size` segments per request, at most `max_workers` requests at a time.
+    Segments that can't be scored get None, so they're neither cached nor
+    mistaken for a score of 0.
+    """
+    cache = get_cache(work_dir)
+    answers = [None] * len(segment_texts)
+
+    missing = []
+    for i, text in enumerate(segment_texts):
+        path = cache.lookup("broll_score", score_cache_key(cache, text), ".json")
+        if path:
+            with open(path) as f:
+                answers[i] = json.load(f)
+        else:
+            missing.append(i)
+
+    if missing:
+        print(f"Scoring B-roll suitability for {len(missing)} segments "
+              f"({len(segment_texts) - len(missing)} cached)...")
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), max(batch_size, 1))]
+
+    def score_batch(batch):
+        results = request_scores([segment_texts[i] for i in batch])
+        if results is None:
+            return
+        for i, answer in zip(batch, results):
+            answers[i] = answer
+            with cache.produce("broll_score", score_cache_key(cache, segment_texts[i]), ".json") as tmp_path:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(answer, f, ensure_ascii=False)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(score_batch, batches))
+
+    return answers
@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import uuid
+import socket
+import argparse
+import threading
+import traceback
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dotenv import load_dotenv
+from . import cli
+from .cache import configure_cache
+from .models import configure_model_registry, get_model_registry
+from .stages import STAGES, configure_stage_limits, parse_stage_limits, report_stages
+
+JOB_STATES = ("incoming", "running", "done", "failed")
+
+
+class JobQueue:
+    """Spool-directory job queue.
+
+    Each job is a JSON file that moves incoming/ -> running/ -> done/ or failed/.
+    Claiming a job is an atomic rename, so any number of workers (and other
+    processes) can share the spool. Claimed jobs record the process running
+    them, so a restarted server only takes back jobs whose process is gone.
+    Jobs can be submitted by dropping a file with {"args": [...]} (the regular
+    CLI arguments) into incoming/.
+    """
+
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        for state in JOB_STATES:
+            os.makedirs(os.path.join(spool_dir, state), exist_ok=True)
+
+    def _path(self, state, job_id):
+        return os.path.join(self.spool_dir, state, f"{job_id}.json")
+
+    def _write(self, state, job):
+        tmp_path = os.path.join(self.spool_dir, f".{job['id']}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp_path, self._path(state, job["id"]))
+
+    def submit(self, args):
+        # Ids start with the submission time so incoming/ sorts in FIFO order
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        job = {"id": job_id, "args": list(args), "state": "incoming", "submitted_at": time.time()}
+        self._write("incoming", job)
+        return job
+
+    def claim(self):
+        incoming = os.path.join(self.spool_dir, "incoming")
+        for name in sorted(n for n in os.listdir(incoming) if n.endswith(".json")):
+            running_path = os.path.join(self.spool_dir, "running", name)
+            try:
+                os.rename(os.path.join(incoming, name), running_path)
+            except FileNotFoundError:
+                continue  # claimed by another worker
+            submitted_at = os.path.getmtime(running_path)
+            try:
+                with open(running_path) as f:
+                    job = json.load(f)
+                if not isinstance(job, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                # Half-written or malformed file dropped into incoming/
+                job = {"error": f"unreadable job file: {e}"}
+            # The file name is the id, whatever the file says
+            job["id"] = os.path.splitext(name)[0]
+            job.setdefault("submitted_at", submitted_at)
+            job.update(state="running", started_at=time.time(), stages=[],
+                       owner={"host": socket.gethostname(), "pid": os.getpid()})
+            if "error" in job:
+                self.finish(job, "failed")
+                print(f"❌ Job {job['id']} failed: {job['error']}")
+                continue
+            self._write("running", job)
+            return job
+        return None
+
+    def update(self, job):
+        self._write(job["state"], job)
+
+    def finish(self, job, state):
+        job.update(state=state, finished_at=time.time())
+        job["seconds"] = round(job["finished_at"] - job["started_at"], 3)
+        self._write(state, job)
+        os.remove(self._path("running", job["id"]))
+
+    def requeue_running(self):
+        # Jobs left in running/ by a process that died. Jobs of live processes,
+        # or of other hosts which can't be checked, are left alone.
+        host = socket.gethostname()
+        running = os.path.join(self.spool_dir, "running")
+        for name in os.listdir(running):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(running, name)) as f:
+                    owner = json.load(f).get("owner") or {}
+            except FileNotFoundError:
+                continue
+            except (ValueError, AttributeError):
+                owner = {}
+            if owner.get("host", host) != host or process_alive(owner.get("pid")):
+                continue
+            try:
+                os.rename(os.path.join(running, name), os.path.join(self.spool_dir, "incoming", name))
+            except FileNotFoundError:
+                continue  # finished or requeued meanwhile
+
+    def get(self, job_id):
+        for state in JOB_STATES:
+            try:
+                with open(self._path(state, job_id)) as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                continue
+        return None
+
+    def list(self):
+        jobs = []
+        for state in JOB_STATES:
+            for name in os.listdir(os.path.join(self.spool_dir, state)):
+                if name.endswith(".json"):
+                    job = self.get(os.path.splitext(name)[0])
+                    if job:
+                        jobs.append(job)
+        return sorted(jobs, key=lambda job: job.get("submitted_at", 0))
+
+
+def process_alive(pid):
+    if not pid or pid == os.getpid():
+        return False
+    if os.name == "nt":
+        return True  # os.kill would terminate it, assume it's still running
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def run_job(queue: JobQueue, job):
+    lock = threading.Lock()
+
+    def on_stage(timing):
+        with lock:
+            job["stages"].append(timing)
+            queue.update(job)
+
+    try:
+        job_args = job.get("args")
+        if not isinstance(job_args, list) or not all(isinstance(a, str) for a in job_args):
+            raise ValueError("job args must be a list of strings")
+        print(f"▶️ Job {job['id']}: {' '.join(job_args)}")
+        args = cli.build_parser().parse_args(job_args)
+        video_paths, horizontals, options, output_dir = cli.job_from_args(args)
+        os.makedirs(output_dir, exist_ok=True)
+        with report_stages(on_stage):
+            cli.create_subtitled_videos(video_paths, horizontals, options, output_dir=output_dir)
+    except (Exception, SystemExit) as e:
+        # argparse reports bad job arguments with SystemExit
+        job["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+        queue.finish(job, "failed")
+        print(f"❌ Job {job['id']} failed: {job['error']}")
+    else:
+        queue.finish(job, "done")
+        print(f"✅ Job {job['id']} done in {job['seconds']:.1f}s")
+
+def worker_loop(queue: JobQueue, stop: threading.Event, poll_interval):
+    while not stop.is_set():
+        job = queue.claim()
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        run_job(queue, job)
+
+
+def make_handler(queue: JobQueue):
+    class JobHandler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body, indent=2).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parts = [p for p in self.path.split("/") if p]
+            if parts == ["jobs"]:
+                return self._send(200, queue.list())
+            if len(parts) == 2 and parts[0] == "jobs":
+                job = queue.get(parts[1])
+                return self._send(200, job) if job else self._send(404, {"error": "unknown job"})
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                return self._send(404, {"error": "not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                args = body["args"]
+                if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+                    raise ValueError("args must be a list of strings")
+            except (ValueError, KeyError) as e:
+                return self._send(400, {"error": f"expected {{\"args\": [...]}}: {e}"})
+            self._send(201, queue.submit(args))
+
+        def log_message(self, format, *args):
+            pass
+
+    return JobHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="auto_subtitle serve",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Keep a warm worker running and process subtitle jobs from a queue.")
+    parser.add_argument("--spool", type=str, default=os.path.join(cli.WORK_DIR, "queue"),
+                        help="spool directory holding incoming/running/done/failed jobs")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="localhost port for the HTTP job API (0 disables it)")
+    parser.add_argument("--concurrency", type=int, default=2,
+                        help="number of jobs processed at the same time")
+    parser.add_argument("--stage-limits", type=str, default=cli.DEFAULT_STAGE_LIMITS,
+                        help=f"maximum concurrent jobs per stage ({', '.join(STAGES)})")
+    parser.add_argument("--preload-model", type=str, default=None,
+                        help="Whisper model to load at startup, e.g. small.en")
+    parser.add_argument("--compute-type", type=str, default="float32", choices=["int8", "float16", "float32"],
+                        help="precision of the preloaded Whisper model")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="CPU threads of the preloaded Whisper model")
+    parser.add_argument("--poll-interval", type=float, default=1.0,
+                        help="seconds between checks of the spool directory")
+    parser.add_argument("--cache-budget", type=float, default=20,
+                        help="disk budget in GB for cached artifacts (0 disables eviction)")
+    parser.add_argument("--model-memory", type=float, default=0,
+                        help="memory budget in GB for resident models (0 keeps all)")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    os.makedirs(cli.WORK_DIR, exist_ok=True)
+    configure_cache(int(args.cache_budget * 1024 ** 3) if args.cache_budget > 0 else None)
+    configure_model_registry(int(args.model_memory * 1024 ** 3) if args.model_memory > 0 else None)
+    configure_stage_limits(parse_stage_limits(args.stage_limits))
+
+    if args.preload_model:
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        registry = get_model_registry()
+        registry.asr(args.preload_model, device, compute_type=args.compute_type, threads=args.threads)
+        registry.align("en", device)
+
+    queue = JobQueue(args.spool)
+    queue.requeue_running()
+
+    stop = threading.Event()
+    workers = [threading.Thread(target=worker_loop, args=(queue, stop, args.poll_interval),
+                                name=f"job-worker-{i}", daemon=True)
+               for i in range(max(args.concurrency, 1))]
+    for worker in workers:
+        worker.start()
+
+    server = None
+    if args.port:
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(queue))
+        threading.Thread(target=server.serve_forever, name="job-api", daemon=True).start()
+        print(f"🛰️ Job API listening on http://127.0.0.1:{args.port}/jobs")
+    print(f"📂 Watching {os.path.join(args.spool, 'incoming')} with {len(workers)} workers")
+
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping after the running jobs finish...")
+        stop.set()
+        if server:
+            server.shutdown()
+        for worker in workers:
+            worker.join()
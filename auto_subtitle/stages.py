@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS in the stage timings
+    resource = None
+
+# Pipeline stages that can be given a concurrency limit
+STAGES = ("audio", "transcribe", "face_track", "render")
+
+_semaphores = {}
+_local = threading.local()
+_profiling = {"mode": None, "out_dir": None}
+_profile_counter = 0
+_profile_lock = threading.Lock()
+
+def configure_stage_limits(limits):
+    """Caps how many threads may run each stage at once, e.g. {"transcribe": 1}."""
+    _semaphores.clear()
+    for name, limit in limits.items():
+        if limit and limit > 0:
+            _semaphores[name] = threading.BoundedSemaphore(limit)
+
+def parse_stage_limits(spec: str):
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}', expected one of {', '.join(STAGES)}")
+        limits[name] = int(value)
+    return limits
+
+def configure_profiling(mode, out_dir="work/profiles"):
+    """Profiles every top-level stage with "cprofile" or "pyinstrument" (None disables)."""
+    _profiling.update(mode=mode, out_dir=out_dir)
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its largest finished child (ffmpeg, workers)."""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    unit = 1 if os.uname().sysname == "Darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return round(own / 1024 ** 2, 1), round(children / 1024 ** 2, 1)
+
+def rss_mb():
+    """Current resident memory of this process (None where /proc isn't available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2, 1)
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+def note(**values):
+    """Adds values (e.g. frames=1200) to the innermost stage running on this thread."""
+    stack = _stack()
+    if stack:
+        stack[-1].update(values)
+
+def note_cache(hit: bool):
+    """Counts an artifact cache lookup against the innermost running stage."""
+    stack = _stack()
+    if stack:
+        cache = stack[-1].setdefault("cache", {"hits": 0, "misses": 0})
+        cache["hits" if hit else "misses"] += 1
+
+def _start_profiler(name):
+    global _profile_counter
+    mode = _profiling["mode"]
+    if not mode:
+        return None
+    with _profile_lock:
+        _profile_counter += 1
+        path = os.path.join(_profiling["out_dir"], f"{_profile_counter:03d}_{name}")
+    try:
+        if mode == "pyinstrument":
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+    except (ImportError, ValueError) as e:
+        # pyinstrument is optional, and only one profiler can be active at a
+        # time on some Pythons (concurrent jobs)
+        print(f"⚠️ Not profiling stage {name}: {e}")
+        return None
+    return mode, profiler, path
+
+def _stop_profiler(started):
+    mode, profiler, path = started
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if mode == "pyinstrument":
+        profiler.stop()
+        path += ".html"
+        with open(path, "w") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        path += ".prof"
+        profiler.dump_stats(path)
+    return path
+
+@contextmanager
+def stage(name):
+    """Runs a pipeline stage: waits for a free slot and reports its timing.
+
+    Yields the stage record, which code inside the stage can extend (see note()).
+    """
+    queued = time.perf_counter()
+    semaphore = _semaphores.get(name)
+    if semaphore:
+        semaphore.acquire()
+    try:
+        stack = _stack()
+        record = {"stage": name}
+        if stack:
+            record["parent"] = stack[-1]["stage"]
+        # Only top-level stages are profiled, nested ones are part of their profile
+        profiler = None if stack else _start_profiler(name)
+        stack.append(record)
+        rss_started = rss_mb()
+        peaks_started = peak_rss_mb()
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - started
+            cpu_seconds = time.process_time() - cpu_started
+            stack.pop()
+            if profiler:
+                record["profile"] = _stop_profiler(profiler)
+            # CPU time and memory are process wide, so they include other threads busy at the same time
+            record.update(waited=round(started - queued, 3), seconds=round(seconds, 3),
+                          cpu_seconds=round(cpu_seconds, 3))
+            rss = rss_mb()
+            if rss is not None and rss_started is not None:
+                record.update(rss_mb=rss, rss_delta_mb=round(rss - rss_started, 1))
+            # High-water marks only tell something about this stage if they rose while it ran
+            for field, peak, peak_started in zip(("peak_rss_mb", "peak_child_rss_mb"), peak_rss_mb(), peaks_started):
+                if peak is not None and peak > peak_started:
+                    record[field] = peak
+            if record.get("frames") and seconds > 0:
+                record["fps"] = round(record["frames"] / seconds, 1)
+            callback = getattr(_local, "on_stage", None)
+            if callback:
+                callback(record)
+    finally:
+        if semaphore:
+            semaphore.release()
+
+@contextmanager
+def report_stages(callback):
+    """Calls `callback(timing)` for every stage finished by the current thread."""
+    previous = getattr(_local, "on_stage", None)
+    _local.on_stage = callback
+    try:
+        yield
+    finally:
+        _local.on_stage = previous
+
+def get_stage_callback():
+    """The current thread's stage callback, to hand to report_stages() in a pool thread."""
+    return getattr(_local, "on_stage", None)
+
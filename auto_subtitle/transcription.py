@@ -0,0 +1,41 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .audio import SAMPLE_RATE, speech_chunks
+
+_worker_model = None
+
+
+def _init_worker(model_size, compute_type, threads):
+    global _worker_model
+    import whisperx
+    _worker_model = whisperx.load_model(model_size, device="cpu", compute_type=compute_type, threads=threads)
+
+def _transcribe_chunk(samples, batch_size):
+    return _worker_model.transcribe(samples, batch_size=batch_size)["segments"]
+
+def start_transcription_pool(model_size, compute_type, workers, threads):
+    """Use ModelRegistry.transcription_pool(), which keeps pools warm across videos within the memory budget."""
+    print(f"Starting {workers} transcription workers ({model_size}, {threads} threads each)...")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(model_size, compute_type, threads))
+
+def transcribe_chunked(samples, pool, batch_size=8, sample_rate=SAMPLE_RATE, max_chunk_seconds=60.0):
+    """Transcribes only the voiced parts of `samples`, chunk by chunk across `pool`.
+
+    Segment times are shifted back to positions in `samples`, so the result can
+    be aligned against the full audio like a serial transcription.
+    """
+    chunks = speech_chunks(samples, sample_rate, max_chunk_seconds=max_chunk_seconds)
+    voiced = sum(end - start for start, end in chunks)
+    print(f"Transcribing {len(chunks)} speech chunks ({voiced / sample_rate:.0f}s of "
+          f"{len(samples) / sample_rate:.0f}s audio)...")
+
+    futures = [pool.submit(_transcribe_chunk, samples[start:end], batch_size) for start, end in chunks]
+    segments = []
+    for (start, _), future in zip(chunks, futures):
+        offset = start / sample_rate
+        for segment in future.result():
+            segment["start"] += offset
+            segment["end"] += offset
+            segments.append(segment)
+    return {"segments": segments, "language": "en"}
@@ -1,17 +1,24 @@
 import ffmpeg
-from moviepy import VideoClip
-import whisperx
 import json
-import tempfile
 
 import os
-import requests
-from typing import Iterator, TextIO
-from .face_tracking import FacePoint
+import threading
+from typing import TYPE_CHECKING, Iterator, TextIO
+from .cache import get_cache
+from .scoring import score_segments, get_openai_client
+from .models import get_model_registry
+from .stages import stage
 
+if TYPE_CHECKING:
+    import requests
+    from moviepy import VideoClip
 
+# whisperx (and torch), moviepy and requests are imported where they're used,
+# so `--help` and fully cached runs don't pay for them
 
-def center_crop_to_aspect_ratio(clip: VideoClip, target_w: int, target_h: int) -> VideoClip:
+
+
+def center_crop_to_aspect_ratio(clip: "VideoClip", target_w: int, target_h: int) -> "VideoClip":
     if clip.aspect_ratio == target_w / target_h:
         return clip
     
@@ -27,64 +34,139 @@ def center_crop_to_aspect_ratio(clip: VideoClip, target_w: int, target_h: int) -
         # Already in target aspect ratio
         return clip
 
-def get_audio(path, output_path=tempfile.gettempdir()):
+def get_audio(path, output_path="work"):
     print(f"Extracting audio from {filename(path)}...")
-    output_file = os.path.join(output_path, f"{filename(path)}.wav")
+    cache = get_cache(output_path)
+    key = cache.key("audio", [path], acodec="pcm_s16le", ac=1, ar=16000)
 
-    if os.path.exists(output_file):
+    output_file = cache.lookup("audio", key, ".wav")
+    if output_file:
         print(f"Audio already extracted at {output_file}, reusing it.")
         return output_file
 
-    ffmpeg.input(path).output(
-        output_file,
-        acodec="pcm_s16le", ac=1, ar="16k"
-    ).run(quiet=True, overwrite_output=True)
+    with cache.produce("audio", key, ".wav") as tmp_file:
+        ffmpeg.input(path).output(
+            tmp_file,
+            acodec="pcm_s16le", ac=1, ar="16k"
+        ).run(quiet=True, overwrite_output=True)
 
-    return output_file
+    return cache.path("audio", key, ".wav")
 
-def generate_and_write_whisperx_json(audio_path, output_json_path="work", model_size="small.en"):
-    output_file = os.path.join(output_json_path, f"{filename(audio_path)}.json")
-    
-    if not os.path.exists(output_file):    
-        import torch
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+def generate_and_write_whisperx_json(audio_path, output_json_path="work", model_size="small.en",
+                                     score_workers=8, score_batch_size=1, compute_type="float32",
+                                     batch_size=8, threads=4, stream_window=None, transcribe_workers=1):
+    """Transcribes, aligns and B-roll scores `audio_path`.
 
-        print(f"Loading WhisperX model {model_size} on {device}...")
-        model = whisperx.load_model(model_size, device=device, compute_type="float32")
+    With `stream_window` (seconds), `audio_path` can be any media file: its audio
+    is piped from ffmpeg and transcribed window by window, so no .wav is needed
+    and memory stays bounded by the window size.
 
-        print(f"Transcribing {audio_path}...")
-        result = model.transcribe(audio_path)
+    With `transcribe_workers` > 1 on CPU, the voiced parts of the audio are
+    transcribed in parallel by a pool of model processes and silence is skipped.
+    """
+    cache = get_cache(output_json_path)
+    params = dict(model=model_size, language="en", compute_type=compute_type)
+    if stream_window:
+        params["stream_window"] = stream_window
+    if transcribe_workers > 1:
+        params["vad_chunks"] = True
+    key = cache.key("whisperx", [audio_path], **params)
+    output_file = cache.lookup("whisperx", key, ".json")
+    
+    if not output_file:
+        import torch
+        import whisperx
+        from .transcription import transcribe_chunked
 
-        aligned_result = align_words(audio_path, result, device=device)
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        # A GPU batches the whole file by itself, worker processes would only compete for it
+        if transcribe_workers > 1 and device == "cpu":
+            # Each worker process holds its own model, the registry keeps the pool warm
+            pool = get_model_registry().transcription_pool(model_size, compute_type, workers=transcribe_workers)
+            transcribe = lambda samples: transcribe_chunked(samples, pool, batch_size)
+        else:
+            # Loaded once and shared by every video in the run
+            model = get_model_registry().asr(model_size, device, compute_type=compute_type, threads=threads)
+            transcribe = lambda samples: model.transcribe(samples, batch_size=batch_size)
+
+        if stream_window:
+            aligned_result = transcribe_streaming(audio_path, transcribe, device, stream_window)
+        else:
+            print(f"Transcribing {audio_path}...")
+            samples = whisperx.load_audio(audio_path)
+            with stage("asr"):
+                result = transcribe(samples)
+
+            aligned_result = align_words(samples, result, device=device)
     else:
         print(f"WhisperX JSON already exists at {output_file}, reusing it.")
-        aligned_result = json.load(open(output_file, "r"))
+        with open(output_file, "r", encoding="utf-8") as f:
+            aligned_result = json.load(f)
     
-    if not all("b_roll_score" in segment for segment in aligned_result.get("segments", [])):
-        for segment in aligned_result["segments"]:
-            print(f"Scoring B-roll suitability for segment: {segment['text'][:80]}...")
-            answer = determine_broll_score(segment["text"])
-            print(f"Answer: {answer}")
+    unscored = [segment for segment in aligned_result.get("segments", []) if "b_roll_score" not in segment]
+    if unscored:
+        with stage("score"):
+            answers = score_segments([segment["text"] for segment in unscored], work_dir=output_json_path,
+                                     max_workers=score_workers, batch_size=score_batch_size)
+        failed = 0
+        for segment, answer in zip(unscored, answers):
+            # Left without a score so the next run retries it
+            if answer is None:
+                failed += 1
+                continue
             segment["b_roll_score"] =  answer.get("score", 0)
             segment["b_roll_prompt"] = answer.get("prompt", None)
             segment["emotional_tone"] = answer.get("emotional_tone", None)
-    else:
+        if failed:
+            print(f"⚠️ {failed} segments couldn't be scored, they'll be retried on the next run.")
+    elif output_file:
         print("✅ B-roll scores already added to all segments, skipping scoring.")
+        return output_file
 
-    print(f"Saving augmented output to {output_file}...")
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(aligned_result, f, ensure_ascii=False, indent=2)
+    # The transcript entry is keyed by audio and model, scores are added to it in place
+    with cache.produce("whisperx", key, ".json") as tmp_file:
+        print(f"Saving augmented output to {cache.path('whisperx', key, '.json')}...")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(aligned_result, f, ensure_ascii=False, indent=2)
 
     print("✅ WhisperX JSON generated successfully.")
-    return output_file
+    return cache.path("whisperx", key, ".json")
 
 
 def align_words(audio_path, result, device="cpu"):
+    import whisperx
+
     print("Aligning words for word-level timestamps...")
-    alignment_model, metadata = whisperx.load_align_model(language_code="en", device=device)
-    aligned_result = whisperx.align(result["segments"], alignment_model, metadata, audio_path, device=device)
+    with stage("align"):
+        alignment_model, metadata = get_model_registry().align("en", device)
+        aligned_result = whisperx.align(result["segments"], alignment_model, metadata, audio_path, device=device)
     return aligned_result
 
+def shift_timestamps(result, offset):
+    for segment in result.get("segments", []):
+        for item in [segment] + segment.get("words", []):
+            for field in ("start", "end"):
+                if field in item:
+                    item[field] += offset
+    for word in result.get("word_segments", []):
+        for field in ("start", "end"):
+            if field in word:
+                word[field] += offset
+    return result
+
+def transcribe_streaming(media_path, transcribe, device, window_seconds=600):
+    from .audio import iter_audio_windows
+
+    segments, word_segments = [], []
+    for offset, samples in iter_audio_windows(media_path, window_seconds):
+        print(f"Transcribing {filename(media_path)} from {format_timestamp(offset)}...")
+        with stage("asr"):
+            result = transcribe(samples)
+        aligned = shift_timestamps(align_words(samples, result, device=device), offset)
+        segments.extend(aligned["segments"])
+        word_segments.extend(aligned.get("word_segments", []))
+    return {"segments": segments, "word_segments": word_segments}
+
 def str2bool(string):
     string = string.lower()
     str2val = {"true": True, "false": False}
@@ -128,9 +210,24 @@ def filename(path):
 def is_vertical(clip):
     return clip.h > clip.w
 
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session() -> "requests.Session":
+    # Pooled connections shared by the concurrent B-roll downloads
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=3)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+    return _http_session
+
 def generate_b_roll_image(prompt: str, output_path: str, vertical: bool = True):
-    from openai import OpenAI
-    client = OpenAI()
+    client = get_openai_client()
 
     try:
         print(f"🎨 Generating B-roll for: {prompt[:80]}...")
@@ -153,46 +250,20 @@ def generate_b_roll_image(prompt: str, output_path: str, vertical: bool = True):
             response_format="url",
         )
         image_url = response.data[0].url
-        img_data = requests.get(image_url).content
+        download = get_http_session().get(image_url, timeout=120)
+        download.raise_for_status()
+        img_data = download.content
         with open(output_path, "wb") as f:
             f.write(img_data)
         print(f"✅ Saved B-roll to {output_path}")
     except Exception as e:
         print(f"❌ Failed to generate B-roll: {e}")
 
-def determine_broll_score(segment_text: str) -> tuple[int, str | None]:
-    system_prompt = """
-    You are a visual assistant trained to select B-roll and supplemental imagery to enhance podcast or YouTube content. 
-
-    Your job is to evaluate whether a given segment can be represented effectively by a single cinematic image. If so, suggest a strong, metaphorical or thematic visual — not a literal one.
-
-    Focus on abstract or emotionally resonant ideas. Avoid clichés and generic imagery. Use simple, evocative phrases like: “waves crashing,” “man standing in a doorway,” or “fog rolling over mountains.”
-
-    Never suggest text overlays. Assume the final use is silent B-roll under voiceover.
-    """
-    
-    user_prompt = f"""
-    Evaluate the following transcript segment and rate how suitable it is for representing with a single cinematic B-roll image.
-
-    Return a JSON object with:
-    - a key `"score"` (an integer from 0 to 10), indicating how visual the moment is.
-    - a key `"emotional_tone"` (a single word, lower case) that is null or captures the emotional tone of the moment, adhering strictly Plutchik’s Wheel of Emotions ("joy", "sadness", "anticipation", "fear", "anger", "disgust", "surprise", "trust"). Don't use any other words or phrases.
-    - a key `"prompt"` only if the score is 8 or above — this should describe a cinematic visual metaphor for the moment, not a literal rephrasing.
-
-    Segment:
-    `{segment_text}`
-
-    Examples:
-    {{ "score": 8, "emotional_tone": "anticipation", "prompt": "A person journaling in a quiet forest clearing, with sunlight breaking through the trees." }},
-    {{ "score": 3, "emotional_tone": null, "prompt": null }}
-    """
-
-    # In the determine_broll_score function, replace the previous selection with:
-    return json.loads(ask_openai(system_prompt, user_prompt))
+def determine_broll_score(segment_text: str) -> dict:
+    return score_segments([segment_text])[0]
 
 def ask_openai(system_prompt: str, user_prompt: str) -> str:
-        from openai import OpenAI
-        client = OpenAI()
+        client = get_openai_client()
         try:
             response = client.chat.completions.create(
                 model="gpt-4",
@@ -205,4 +276,4 @@ def ask_openai(system_prompt: str, user_prompt: str) -> str:
             return answer
         except Exception as e:
             print(f"⚠️ Error: {e}")
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,68 @@
+"""Startup latency of the CLI.
+
+Times `import auto_subtitle.cli` and `auto_subtitle --help` in fresh
+interpreters, and checks that none of the heavy dependencies (torch,
+whisperx, mediapipe, moviepy, cv2) are imported before a stage needs them.
+Exits non-zero when the median startup exceeds the threshold, so it can
+guard startup latency in CI.
+
+    python benchmarks/bench_import_time.py [--threshold 0.5] [--runs 5]
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HEAVY_MODULES = ["torch", "whisperx", "mediapipe", "moviepy", "cv2", "scipy", "openai"]
+
+IMPORT_SNIPPET = f"""
+import json, sys, time
+started = time.perf_counter()
+import auto_subtitle.cli
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+HELP_SNIPPET = """
+import sys, time
+started = time.perf_counter()
+sys.argv = ["auto_subtitle", "--help"]
+try:
+    from auto_subtitle.cli import main
+    main()
+except SystemExit:
+    pass
+print(time.perf_counter() - started, file=sys.stderr)
+"""
+
+def run_import():
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def run_help():
+    out = subprocess.run([sys.executable, "-c", HELP_SNIPPET], capture_output=True, text=True, check=True)
+    return float(out.stderr.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="maximum median seconds for `auto_subtitle --help`")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    imports = [run_import() for _ in range(args.runs)]
+    helps = [run_help() for _ in range(args.runs)]
+    import_median = statistics.median(r["seconds"] for r in imports)
+    help_median = statistics.median(helps)
+    heavy = sorted({m for r in imports for m in r["heavy"]})
+
+    print(f"{'import auto_subtitle.cli':<28} {import_median * 1000:>8.1f} ms")
+    print(f"{'auto_subtitle --help':<28} {help_median * 1000:>8.1f} ms  (threshold {args.threshold * 1000:.0f} ms)")
+    print(f"{'heavy modules at import':<28} {', '.join(heavy) or 'none'}")
+
+    if heavy or help_median > args.threshold:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Per-frame compositing time vs. number of overlays.
+
+Compares moviepy's CompositeVideoClip, which checks every overlay on every
+frame, with IndexedCompositeVideoClip, which only looks at the overlays in the
+current time bucket. Overlays are laid out like word captions: short clips,
+a few on screen at any time.
+
+    python benchmarks/bench_overlay_index.py
+"""
+import time
+import numpy as np
+from moviepy import ColorClip, CompositeVideoClip
+from auto_subtitle.overlay_index import IndexedCompositeVideoClip
+
+SIZE = (1080, 1920)
+WORD_SECONDS = 0.4
+SAMPLED_FRAMES = 60
+
+def make_overlays(count):
+    overlays = []
+    for i in range(count):
+        start = i * WORD_SECONDS
+        overlays.append(
+            ColorClip((400, 120), color=(255, 255, 255))
+            .with_start(start)
+            .with_end(start + WORD_SECONDS)
+            .with_position(("center", 1500))
+        )
+    return overlays
+
+def time_per_frame(clip, duration):
+    times = np.linspace(0, duration, SAMPLED_FRAMES, endpoint=False)
+    started = time.perf_counter()
+    for t in times:
+        clip.get_frame(t)
+    return (time.perf_counter() - started) / SAMPLED_FRAMES
+
+def main():
+    print(f"{'overlays':>10} {'composite ms/frame':>20} {'indexed ms/frame':>18}")
+    for count in (100, 1_000, 5_000, 20_000):
+        duration = count * WORD_SECONDS
+        background = ColorClip(SIZE, color=(0, 0, 0), duration=duration)
+        overlays = make_overlays(count)
+
+        plain = CompositeVideoClip([background] + overlays)
+        indexed = IndexedCompositeVideoClip([background] + overlays)
+        print(f"{count:>10} {time_per_frame(plain, duration) * 1000:>20.2f} "
+              f"{time_per_frame(indexed, duration) * 1000:>18.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Checks that parallel rendering is frame-identical to serial rendering.
+
+Renders the same synthetic input (long enough for several chunks) with
+--jobs 1 and --jobs N, both caption engines, and compares the per-frame hashes
+of the outputs (ffmpeg -f framemd5). Both outputs must also have every frame
+of the timeline at its frame rate. Exits non-zero on any difference.
+
+    python benchmarks/check_render_parity.py [--jobs 2] [--duration 75]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_benchmarks import FPS, scratch_dir  # noqa: E402
+from synthetic import make_video, make_whisperx_json, install_stub_openai  # noqa: E402
+
+# A small output keeps the check quick, the chunking doesn't depend on it
+OUTPUT_SCALE = 0.25
+
+
+def frame_hashes(path):
+    out = subprocess.run(["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path, "-map", "0:v",
+                          "-f", "framemd5", "-"], capture_output=True, text=True, check=True).stdout
+    return [line.rsplit(",", 1)[-1].strip() for line in out.splitlines() if line and not line.startswith("#")]
+
+def frame_rate(path):
+    out = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=avg_frame_rate",
+                          "-of", "csv=p=0", path], capture_output=True, text=True, check=True).stdout.strip()
+    num, _, den = out.partition("/")
+    return float(num) / float(den or 1)
+
+def render(jobs, prepared, horizontals, duration, video):
+    from auto_subtitle import cli
+    from auto_subtitle.render import render_timeline
+
+    output_files = {h: f"output_{cli.aspect_name(h)}_jobs{jobs}.mp4" for h in horizontals}
+    render_timeline([((prepared, horizontals), duration, video)], output_files, cli.build_input_clips, FPS,
+                    jobs=jobs, encoder_settings=dict(preset="ultrafast", codec="libx264"),
+                    audio_path=video, work_dir=cli.WORK_DIR)
+    return output_files
+
+def check(caption_engine, jobs, duration):
+    from auto_subtitle import cli
+    from auto_subtitle.broll import BrollPrefetcher
+    from auto_subtitle.face_tracking import track_face_centers
+    from auto_subtitle.render import plan_chunks, probe_keyframes
+
+    horizontals = (False, True)
+    with scratch_dir():
+        stub = install_stub_openai(latency=0.0)
+        video = make_video("input.mp4", duration, (1280, 720), FPS)
+        transcript = make_whisperx_json("transcript.json", duration)
+        os.makedirs(cli.WORK_DIR, exist_ok=True)
+        broll = BrollPrefetcher()
+        broll.submit(transcript, duration, [not h for h in horizontals])
+        broll.wait()
+        broll.shutdown()
+        track_face_centers(video, work_dir=cli.WORK_DIR)
+        prepared = cli.PreparedInput(video, transcript, duration, caption_engine, FPS, OUTPUT_SCALE)
+        chunks = len(plan_chunks(duration, FPS, probe_keyframes(video)))
+
+        serial = render(1, prepared, horizontals, duration, video)
+        parallel = render(jobs, prepared, horizontals, duration, video)
+        stub.close()
+
+        # Both renders could be wrong the same way, so they're also checked against the timeline
+        expected_frames = int(duration * FPS)
+        identical = True
+        for h in horizontals:
+            serial_hashes, parallel_hashes = frame_hashes(serial[h]), frame_hashes(parallel[h])
+            mismatches = [i for i, (a, b) in enumerate(zip(serial_hashes, parallel_hashes)) if a != b]
+            same = not mismatches and len(serial_hashes) == len(parallel_hashes)
+            detail = "identical" if same else (
+                f"DIFFERENT: {len(serial_hashes)} vs {len(parallel_hashes)} frames, "
+                f"first mismatch at frame {mismatches[0] if mismatches else min(len(serial_hashes), len(parallel_hashes))}")
+            for path, hashes in ((serial[h], serial_hashes), (parallel[h], parallel_hashes)):
+                fps = frame_rate(path)
+                if len(hashes) != expected_frames or abs(fps - FPS) > 0.01:
+                    same = False
+                    detail += f"; {path} has {len(hashes)} frames at {fps:g} fps, expected {expected_frames} at {FPS}"
+            identical &= same
+            print(f"{caption_engine:<8} {cli.aspect_name(h):<5} {chunks} chunks, jobs 1 vs {jobs}: {detail}")
+    return identical
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=2, help="render processes of the parallel render")
+    parser.add_argument("--duration", type=float, default=75,
+                        help="seconds of synthetic input, at least a few chunks long")
+    args = parser.parse_args()
+
+    results = [check(engine, args.jobs, args.duration) for engine in ("moviepy", "ass")]
+    if not all(results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Chunked vs. serial transcription on a fixed clip.
+
+Transcribes the clip once with a single model, like the default path, and
+once split into voice-activity chunks across a pool of worker processes
+(--transcribe-workers). Prints both timings and the word error rate of the
+chunked transcript against the serial one, and exits non-zero when it exceeds
+the threshold. Needs whisperx and the model, so it isn't part of the offline
+suite.
+
+    python benchmarks/compare_transcription.py clip.mp4 [--workers 4] [--max-wer 0.05]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def words(result):
+    text = " ".join(segment["text"] for segment in result["segments"])
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+def word_error_rate(reference, hypothesis):
+    """Word-level edit distance over the reference length."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1] / max(len(reference), 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("clip", help="audio or video file to transcribe")
+    parser.add_argument("--model", default="small.en")
+    parser.add_argument("--compute-type", default="float32", choices=["int8", "float16", "float32"])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=4, help="CPU threads of the serial model")
+    parser.add_argument("--workers", type=int, default=4, help="transcription worker processes")
+    parser.add_argument("--max-wer", type=float, default=0.05,
+                        help="largest word error rate of the chunked transcript that still passes")
+    args = parser.parse_args()
+
+    import whisperx
+    from auto_subtitle.models import get_model_registry
+    from auto_subtitle.transcription import transcribe_chunked
+
+    samples = whisperx.load_audio(args.clip)
+    registry = get_model_registry()
+
+    model = registry.asr(args.model, "cpu", compute_type=args.compute_type, threads=args.threads)
+    started = time.perf_counter()
+    serial = model.transcribe(samples, batch_size=args.batch_size)
+    serial_seconds = time.perf_counter() - started
+
+    pool = registry.transcription_pool(args.model, args.compute_type, workers=args.workers)
+    # Workers load their models when they start, keep that out of the timing
+    for future in [pool.submit(int) for _ in range(args.workers)]:
+        future.result()
+    started = time.perf_counter()
+    chunked = transcribe_chunked(samples, pool, args.batch_size)
+    chunked_seconds = time.perf_counter() - started
+    registry.clear()
+
+    serial_words, chunked_words = words(serial), words(chunked)
+    wer = word_error_rate(serial_words, chunked_words)
+    print(f"serial   {serial_seconds:>8.1f}s {len(serial_words):>7} words")
+    print(f"chunked  {chunked_seconds:>8.1f}s {len(chunked_words):>7} words "
+          f"({serial_seconds / chunked_seconds:.2f}x, {args.workers} workers)")
+    print(f"word error rate vs. serial: {wer:.3f} (max {args.max_wer})")
+    if wer > args.max_wer:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
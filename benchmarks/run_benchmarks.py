@@ -0,0 +1,239 @@
+"""Offline benchmark suite on synthetic media.
+
+Measures face tracking, overlay construction, the per-frame crop/scale and
+composite function, B-roll scoring against a stubbed OpenAI client and an
+end-to-end render (from a canned transcript) at several durations and
+resolutions. Every case starts with cold caches in a scratch work directory.
+
+Results are written as JSON, one record per case with its parameters,
+seconds and throughput, so runs can be compared from commit to commit:
+
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_video, make_whisperx_json, install_stub_openai  # noqa: E402
+
+FPS = 30
+FRAME_SAMPLES = 90
+
+# (durations in seconds, resolutions) per suite size
+CASES = {
+    "quick": {"durations": [10], "sizes": [(1280, 720)], "words": [100, 1_000]},
+    "full": {"durations": [10, 60, 300], "sizes": [(1280, 720), (1920, 1080), (3840, 2160)],
+             "words": [100, 1_000, 10_000]},
+}
+
+
+def git_revision():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+@contextmanager
+def scratch_dir():
+    """Runs a case in an empty work directory with every in-process cache reset."""
+    from auto_subtitle import cache, raster_cache, emoji_atlas, emoji
+
+    previous = os.getcwd()
+    path = tempfile.mkdtemp(prefix="auto_subtitle_bench_")
+    # Relative assets the pipeline expects in the working directory
+    for asset in ("external", "Bangers-Regular.ttf"):
+        if os.path.exists(os.path.join(REPO_ROOT, asset)):
+            os.symlink(os.path.join(REPO_ROOT, asset), os.path.join(path, asset))
+    cache._caches.clear()
+    raster_cache._word_raster_cache = None
+    emoji_atlas._emoji_atlas = None
+    emoji._animation_frames.clear()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(path, ignore_errors=True)
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+def result(name, params, seconds, amount, unit):
+    return {"name": name, "params": params, "seconds": round(seconds, 4),
+            "throughput": round(amount / seconds, 2) if seconds > 0 else None, "unit": unit}
+
+
+def bench_face_tracking(duration, size):
+    from auto_subtitle.face_tracking import track_face_centers
+
+    with scratch_dir():
+        video = make_video("input.mp4", duration, size, FPS)
+        seconds = timed(lambda: track_face_centers(video, work_dir="work"))
+    return result("face_tracking", {"duration": duration, "size": f"{size[0]}x{size[1]}"},
+                  seconds, duration * FPS, "frames/s")
+
+def bench_overlays(words, vertical=True):
+    from moviepy import ColorClip
+    from auto_subtitle.emoji import build_overlays
+
+    size = (1080, 1920) if vertical else (1920, 1080)
+    duration = words / 2.5
+    with scratch_dir():
+        transcript = make_whisperx_json("transcript.json", duration)
+        clip = ColorClip(size, color=(0, 0, 0), duration=duration).with_fps(FPS)
+        overlays = []
+        seconds = timed(lambda: overlays.extend(build_overlays(clip, transcript, generate_broll=False, fps=FPS)))
+    return result("build_overlays", {"words": words, "size": f"{size[0]}x{size[1]}"},
+                  seconds, len(overlays), "overlays/s")
+
+def bench_frame_function(size, horizontal):
+    from moviepy import VideoFileClip
+    from auto_subtitle.cli import build_subtitled_clip
+    from auto_subtitle.face_tracking import track_face_centers
+
+    duration = FRAME_SAMPLES / FPS + 1
+    with scratch_dir():
+        video = make_video("input.mp4", duration, size, FPS)
+        transcript = make_whisperx_json("transcript.json", duration)
+        source = VideoFileClip(video)
+        clip = build_subtitled_clip(source, track_face_centers(video, work_dir="work"), transcript,
+                                    horizontal, fps=FPS)
+        # Frames are asked for in order, like the renderer does
+        seconds = timed(lambda: [clip.get_frame(i / FPS) for i in range(FRAME_SAMPLES)])
+        source.close()
+    return result("frame_function", {"size": f"{size[0]}x{size[1]}", "output": "16x9" if horizontal else "9x16"},
+                  seconds, FRAME_SAMPLES, "frames/s")
+
+def bench_scoring(segments, workers):
+    from auto_subtitle.scoring import score_segments
+
+    with scratch_dir():
+        stub = install_stub_openai(latency=0.05)
+        texts = [f"segment {i} about something worth seeing" for i in range(segments)]
+        seconds = timed(lambda: score_segments(texts, work_dir="work", max_workers=workers))
+        stub.close()
+    return result("broll_scoring", {"segments": segments, "workers": workers, "latency": 0.05},
+                  seconds, segments, "segments/s")
+
+def bench_render(duration, size, jobs, caption_engine="moviepy"):
+    from auto_subtitle import cli
+    from auto_subtitle.broll import BrollPrefetcher
+    from auto_subtitle.face_tracking import track_face_centers
+    from auto_subtitle.render import render_timeline
+
+    horizontals = (False, True)
+    with scratch_dir():
+        stub = install_stub_openai(latency=0.0)
+        video = make_video("input.mp4", duration, size, FPS)
+        transcript = make_whisperx_json("transcript.json", duration)
+        os.makedirs(cli.WORK_DIR, exist_ok=True)
+        # The canned transcript replaces audio extraction and transcription
+        broll = BrollPrefetcher()
+        broll.submit(transcript, duration, [not h for h in horizontals])
+        broll.wait()
+        broll.shutdown()
+        track_face_centers(video, work_dir=cli.WORK_DIR)
+        prepared = cli.PreparedInput(video, transcript, duration, caption_engine, FPS)
+        output_files = {h: f"output_{cli.aspect_name(h)}.mp4" for h in horizontals}
+
+        seconds = timed(lambda: render_timeline([((prepared, horizontals), duration, video)], output_files,
+                                                cli.build_input_clips, FPS, jobs=jobs,
+                                                encoder_settings=dict(preset="medium", codec="libx264"),
+                                                audio_path=video, work_dir=cli.WORK_DIR))
+        stub.close()
+    return result("render", {"duration": duration, "size": f"{size[0]}x{size[1]}", "jobs": jobs,
+                             "caption_engine": caption_engine, "outputs": len(horizontals)},
+                  seconds, duration * FPS * len(horizontals), "frames/s")
+
+
+def run_suite(suite, only, jobs):
+    cases = CASES[suite]
+    benches = []
+    for size in cases["sizes"]:
+        for duration in cases["durations"]:
+            benches.append(("face_tracking", bench_face_tracking, (duration, size)))
+    for words in cases["words"]:
+        benches.append(("build_overlays", bench_overlays, (words,)))
+    for size in cases["sizes"]:
+        for horizontal in (False, True):
+            benches.append(("frame_function", bench_frame_function, (size, horizontal)))
+    for segments in (20, 200):
+        benches.append(("broll_scoring", bench_scoring, (segments, 8)))
+    for size in cases["sizes"]:
+        for duration in cases["durations"]:
+            for caption_engine in ("moviepy", "ass"):
+                benches.append(("render", bench_render, (duration, size, jobs, caption_engine)))
+
+    results = []
+    for name, bench, args in benches:
+        if only and name not in only:
+            continue
+        record = bench(*args)
+        print(f"{record['name']:<16} {json.dumps(record['params']):<80} "
+              f"{record['seconds']:>9.3f}s {record['throughput'] or 0:>10.1f} {record['unit']}")
+        results.append(record)
+    return results
+
+def case_id(record):
+    return record["name"] + json.dumps(record["params"], sort_keys=True)
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {case_id(r): r for r in json.load(f)["results"]}
+    print(f"\nThroughput vs {baseline_path}:")
+    for record in results:
+        before = baseline.get(case_id(record))
+        if before and before["throughput"] and record["throughput"]:
+            ratio = record["throughput"] / before["throughput"]
+            print(f"{record['name']:<16} {json.dumps(record['params']):<80} {ratio:>6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="short durations and one resolution")
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="benchmarks to run (face_tracking, build_overlays, frame_function, broll_scoring, render)")
+    parser.add_argument("--jobs", type=int, default=1, help="render processes for the end-to-end render")
+    parser.add_argument("--output", type=str, default=None,
+                        help="results file (default benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", type=str, default=None, help="earlier results file to compare throughput with")
+    args = parser.parse_args()
+
+    sha, dirty = git_revision()
+    suite = "quick" if args.quick else "full"
+    results = run_suite(suite, args.only, args.jobs)
+    report = {
+        "commit": sha, "dirty": dirty, "suite": suite, "timestamp": time.time(),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "cpus": os.cpu_count(), "results": results,
+    }
+
+    output = args.output or os.path.join(REPO_ROOT, "benchmarks", "results",
+                                         f"{time.strftime('%Y%m%d-%H%M%S')}-{(sha or 'unknown')[:8]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
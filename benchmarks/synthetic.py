@@ -0,0 +1,163 @@
+"""Synthetic, offline inputs for the benchmarks.
+
+- make_video: ffmpeg testsrc video with a sine tone and a drawn face-like
+  pattern (skin-coloured head, eyes, mouth) that drifts across the frame,
+  with a hard cut halfway.
+- make_whisperx_json: canned WhisperX output with word timings and B-roll
+  scores, so nothing has to be transcribed or scored.
+- StubOpenAI: stands in for the OpenAI client. Chat answers are derived from
+  the prompt, images are served from a local HTTP server.
+"""
+import io
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+import subprocess
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = [
+    "happy", "pizza", "rocket", "heart", "money", "music", "coffee", "sleep", "think", "world",
+    "the", "and", "you", "we", "that", "about", "really", "people", "moment", "change",
+    "growth", "quiet", "fire", "ocean", "mountain", "light", "dream", "friend", "laugh", "time",
+]
+
+def make_video(path, duration, size=(1280, 720), fps=30):
+    """Writes a synthetic talking-head-like video with keyframes every two seconds.
+
+    Halfway through there's a hard cut to another background with the face
+    further left, like a change of camera angle.
+    """
+    w, h = size
+    face_w, face_h = h // 3, int(h // 3 * 1.3)
+    eye_w, eye_h = max(face_w // 8, 2), max(face_w // 12, 2)
+    eyes = [
+        f"drawbox=x={face_w // 2 + dx - eye_w // 2}:y={face_h // 2 - int(face_w * 0.2)}:"
+        f"w={eye_w}:h={eye_h}:color=black@1:t=fill"
+        for dx in (-int(face_w * 0.22), int(face_w * 0.22))
+    ]
+    mouth_w, mouth_h = face_w // 3, max(face_w // 14, 2)
+    mouth = (f"drawbox=x={(face_w - mouth_w) // 2}:y={face_h // 2 + int(face_w * 0.3)}:"
+             f"w={mouth_w}:h={mouth_h}:color=0x8B0000@1:t=fill")
+    cut = duration / 2
+    # drawbox only evaluates its position once, overlay does it per frame (t in seconds)
+    x = f"(W-w)/2+W/8*sin(t/2)-if(gte(t,{cut}),W/4,0)"
+    graph = ";".join([
+        f"[0:v][1:v]overlay=enable='gte(t,{cut})'[bg]",
+        f"[2:v]{','.join(eyes + [mouth])}[face]",
+        f"[bg][face]overlay=x='{x}':y='(H-h)/2':eval=frame[v]",
+    ])
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc=size={w}x{h}:rate={fps}:duration={duration}",
+        "-f", "lavfi", "-i", f"smptebars=size={w}x{h}:rate={fps}:duration={duration}",
+        "-f", "lavfi", "-i", f"color=c=0xE0AC69:size={face_w}x{face_h}:rate={fps}:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=44100:duration={duration}",
+        "-filter_complex", graph, "-map", "[v]", "-map", "3:a",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-g", str(fps * 2),
+        "-c:a", "aac", "-shortest", path,
+    ]
+    subprocess.run(cmd, check=True)
+    return path
+
+def make_whisperx_json(path, duration, words_per_second=2.5, words_per_segment=12, seed=0):
+    """Writes canned WhisperX JSON covering `duration`, already B-roll scored."""
+    rng = random.Random(seed)
+    word_seconds = 1 / words_per_second
+    segments, word_segments = [], []
+    t = 0.0
+    while t + word_seconds <= duration:
+        words = []
+        for _ in range(words_per_segment):
+            if t + word_seconds > duration:
+                break
+            word = {"word": rng.choice(WORDS), "start": round(t, 3),
+                    "end": round(t + word_seconds * 0.85, 3), "score": 0.9}
+            words.append(word)
+            t += word_seconds
+        score = rng.randint(0, 10)
+        text = " ".join(word["word"] for word in words)
+        segments.append({
+            "start": words[0]["start"], "end": words[-1]["end"], "text": text, "words": words,
+            "b_roll_score": score,
+            "b_roll_prompt": f"cinematic scene about {words[0]['word']}" if score >= 8 else None,
+            "emotional_tone": "joy" if score >= 5 else None,
+        })
+        word_segments.extend(words)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"segments": segments, "word_segments": word_segments}, f, indent=2)
+    return path
+
+def _png_bytes(size=(1024, 1792)):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (40, 90, 140)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class StubOpenAI:
+    """Offline stand-in for openai.OpenAI with a fixed latency per request."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        images = {"portrait": _png_bytes((1024, 1792)), "landscape": _png_bytes((1792, 1024))}
+
+        class ImageHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = images["portrait" if "portrait" in self.path else "landscape"]
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.images = SimpleNamespace(generate=self._image)
+
+    def _wait(self):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+    @staticmethod
+    def _answer(text):
+        score = int(hashlib.sha1(text.encode("utf-8")).hexdigest(), 16) % 11
+        return {"score": score, "emotional_tone": "joy" if score >= 5 else None,
+                "prompt": f"cinematic scene about {text[:30]}" if score >= 8 else None}
+
+    def _chat(self, model, messages, **kwargs):
+        self._wait()
+        prompt = messages[-1]["content"]
+        batch = re.findall(r"^\s+(\d+): `(.*)`$", prompt, flags=re.MULTILINE)
+        if batch:
+            answer = [dict(self._answer(text), index=int(i)) for i, text in batch]
+        else:
+            answer = self._answer(re.search(r"Segment:\s*`(.*)`", prompt).group(1))
+        message = SimpleNamespace(content=json.dumps(answer))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def _image(self, size="1024x1792", **kwargs):
+        self._wait()
+        orientation = "portrait" if size == "1024x1792" else "landscape"
+        url = f"http://127.0.0.1:{self.server.server_address[1]}/{orientation}.png"
+        return SimpleNamespace(data=[SimpleNamespace(url=url)])
+
+    def close(self):
+        self.server.shutdown()
+
+def install_stub_openai(latency=0.05) -> StubOpenAI:
+    """Makes auto_subtitle use a StubOpenAI instead of the real API."""
+    from auto_subtitle import scoring
+    stub = StubOpenAI(latency)
+    scoring._client = stub
+    return stub